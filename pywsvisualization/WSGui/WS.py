@@ -1,47 +1,73 @@
 import logging
 import json
 import sys
+import time
 import traceback
 import pygame as pg
 
 from pywsvisualization.pub_sub import PubSubAMQP
 
 from .WSLayout import WSLayout
+from .WSModel import WSMapModel
 from .WSParticle import WSParticles
 from .WSRobot import WSRobots
-from .scaling import get_scaling_factor
+from .WSLod import WSLod
+from .WSStaleness import WSStaleness, WSLatency, to_epoch_seconds
+from .WSMotion import WSJitterBuffer
+from .WSEvents import WSZoneMonitor
+from .WSSprites import WSSpriteAtlas, WSSpriteBatch
+import math
+from .scaling import get_scaling_factor, get_view_rect, scale
 
 # logger for this file
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('/tmp/virtualwsgui.log')
-handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(levelname)-8s-[%(filename)s:%(lineno)d]-%(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
 class WS:
-    def __init__(self, workspace, eventloop):
+    def __init__(self, workspace, eventloop, attributes=None, headless=False, clock=None):
         """
         Initialization of workspace
         :param workspace: workspace configuration file
         :param eventloop: eventloop for Pub-sub
+        :param attributes: scene attributes (optional)
+        :param headless: render to an off-screen surface instead of the display
+        :param clock: clock with time() and monotonic() for telemetry timing, e.g. a simulated clock
+                      of the soak harness (default: time module)
         """
         try:
-            self.id = workspace["id"]
-            self.dimensions = [workspace["render"]["dimensions"][0] * get_scaling_factor(),
-                               workspace["render"]["dimensions"][1] * get_scaling_factor()]
-            self.type = workspace["render"]["type"]
-            self.screen = pg.display.set_mode(self.dimensions)
-            self.layout = WSLayout(config=workspace, screen=self.screen)
-            self.particles = WSParticles(config=workspace["particles"], screen=self.screen)
-            self.robots = WSRobots(config=workspace["robots"], screen=self.screen)
+            if attributes is None:
+                attributes = {}
+            self.model = WSMapModel(workspace=workspace)
+            self.id = self.model.id
+            self.dimensions = [self.model.dimensions[0] * get_scaling_factor(),
+                               self.model.dimensions[1] * get_scaling_factor()]
+            self.type = self.model.type
+            if headless:
+                self.screen = pg.Surface(self.dimensions)
+            else:
+                self.screen = pg.display.set_mode(self.dimensions)
+            self.layout = WSLayout(config=self.model, screen=self.screen, viewport=attributes.get("viewport"))
+            self.staleness = WSStaleness(config=attributes.get("staleness"))
+            self.latency = WSLatency()
+            self.clock = clock if clock is not None else time
+            self.atlas = WSSpriteAtlas()
+            self.batch = WSSpriteBatch(atlas=self.atlas)
+            self.particles = WSParticles(config=self.model.particles, screen=self.screen,
+                                         staleness=self.staleness, latency=self.latency, atlas=self.atlas,
+                                         interpolation=attributes.get("interpolation"), clock=self.clock)
+            self.robots = WSRobots(config=self.model.robots, screen=self.screen,
+                                   staleness=self.staleness, latency=self.latency, atlas=self.atlas,
+                                   interpolation=attributes.get("interpolation"), clock=self.clock)
+            self.lod = WSLod(config=attributes.get("lod"))
+            self.jitter = WSJitterBuffer(config=attributes.get("jitter"))
+            self.frame_time = None
             self.event_loop = eventloop
-            protocol = workspace["protocol"]
+            protocol = self.model.protocol
 
             # Subscriber
             self.subscribers = []
+            self.regions = {}
+            self.region_view = None
             if protocol["subscribers"] is not None:
                 for subscriber in protocol["subscribers"]:
                     if subscriber["type"] == "amq":
@@ -58,6 +84,26 @@ class WS:
                         logger.error("Provide protocol amq config")
                         raise AssertionError("Provide protocol amq config")
 
+            # Publisher of derived events (zone violations, frame metrics)
+            self.publishers = []
+            if protocol.get("publishers") is not None:
+                for publisher in protocol["publishers"]:
+                    if publisher["type"] == "amq":
+                        logger.debug('Setting Up AMQP Publisher for events %s', publisher.get("events"))
+                        self.publishers.append(
+                            PubSubAMQP(
+                                eventloop=eventloop,
+                                config_file=publisher,
+                                binding_suffix=""
+                            )
+                        )
+                    else:
+                        logger.error("Provide protocol amq config")
+                        raise AssertionError("Provide protocol amq config")
+            self.zone_monitor = WSZoneMonitor()
+            # last frame metrics event per publisher, publishers have their own intervals
+            self.last_metrics_event = {}
+
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -75,8 +121,12 @@ class WS:
         :return: None
         """
         try:
+            for subscriber, keys in self.subscription_updates(view=get_view_rect(self.screen.get_size())):
+                await subscriber.update_bindings(keys)
             for subscriber in self.subscribers:
                 await subscriber.connect(mode="subscriber")
+            for publisher in self.publishers:
+                await publisher.connect(mode="publisher")
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -88,6 +138,106 @@ class WS:
             logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
             sys.exit()
 
+    def binding_keys(self, subscriber, regions):
+        """
+        Routing keys of a subscriber for this workspace
+        :param subscriber: PubSubAMQP subscriber with binding templates
+        :param regions: names of visible region tiles
+        :return: set of routing keys
+        """
+        entities = subscriber.entities if subscriber.entities is not None else ["*"]
+        keys = set()
+        for template in subscriber.binding_templates:
+            for entity in entities:
+                for region in (regions if "{region}" in template else ["*"]):
+                    keys.add(template.format(map_id=self.id, region=region, entity=entity))
+        return keys
+
+    def subscription_updates(self, view):
+        """
+        Routing keys of subscribers with region bindings whose visible region tiles changed.
+        Tiles are limited to the map; if more than `max_regions` tiles are visible a single
+        region wildcard is bound instead. Zone violation events cover the whole map, so while a
+        publisher sends them the region wildcard is always bound.
+        :param view: visible world bounding box
+        :return: list of (subscriber, routing keys)
+        """
+        view = tuple(view)
+        if view == self.region_view:
+            return []
+        self.region_view = view
+        width, height = self.model.dimensions
+        # entities outside the view are needed for derived events
+        unfiltered = any("zone_violation" in publisher.config_events for publisher in self.publishers)
+        updates = []
+        for index, subscriber in enumerate(self.subscribers):
+            if subscriber.binding_templates is None:
+                continue
+            size = subscriber.region_size
+            x_range = range(max(0, math.floor(view[0] / size)),
+                            min(math.floor(view[2] / size), math.floor(width / size)) + 1)
+            y_range = range(max(0, math.floor(view[1] / size)),
+                            min(math.floor(view[3] / size), math.floor(height / size)) + 1)
+            if unfiltered or len(x_range) * len(y_range) > subscriber.max_regions:
+                regions = frozenset(["*"])
+            else:
+                regions = frozenset(f"{x}_{y}" for x in x_range for y in y_range)
+            if regions != self.regions.get(index):
+                self.regions[index] = regions
+                updates.append((subscriber, self.binding_keys(subscriber, regions)))
+        return updates
+
+    def update_subscriptions(self, view):
+        """
+        Rebind subscribers with region bindings to the region tiles in view
+        :param view: visible world bounding box
+        :return: None
+        """
+        for subscriber, keys in self.subscription_updates(view=view):
+            self.event_loop.create_task(subscriber.update_bindings(keys))
+
+    async def terminate(self):
+        """
+        Close the subscriber connections (exclusive queues are removed by the broker) and the
+        publisher connections after sending buffered events
+        :return: None
+        """
+        for subscriber in self.subscribers:
+            if subscriber.connection is not None:
+                await subscriber.terminate()
+        for publisher in self.publishers:
+            if publisher.connection is not None:
+                await publisher.flush(timeout=2.0)
+                await publisher.terminate()
+
+    def publish_events(self, playout_time):
+        """
+        Queue derived events on the publishers that requested them. Publishing never blocks the
+        render loop; events are dropped when a publisher's outbound buffer is full.
+        :param playout_time: playout time of the frame in seconds since epoch
+        :return: None
+        """
+        zone_events = None
+        metrics_event = None
+        now = self.clock.monotonic()
+        for publisher in self.publishers:
+            events = publisher.config_events
+            if "zone_violation" in events:
+                if zone_events is None:
+                    zone_events = self.zone_monitor.update(robots=self.robots.robots,
+                                                           particles=self.particles.particles,
+                                                           timestamp=playout_time)
+                for event in zone_events:
+                    publisher.publish_nowait(json.dumps(dict(event, map=self.id)).encode(),
+                                             routing_key=f'zone_violation.{self.id}')
+            if "frame_metrics" in events and \
+                    now - self.last_metrics_event.get(publisher, float("-inf")) >= publisher.metrics_interval:
+                if metrics_event is None:
+                    metrics_event = json.dumps(dict(self.get_metrics(), event="frame_metrics",
+                                                    timestamp=self.clock.time())).encode()
+                publisher.publish_nowait(metrics_event, routing_key=f'frame_metrics.{self.id}')
+                self.last_metrics_event[publisher] = now
+
     async def robot_msg_handler(self,exchange_name, binding_name, message_body):
         try:
             if type(message_body) is bytes:
@@ -98,16 +248,20 @@ class WS:
                     ("elbow" in msg_attributes) and \
                     ("wrist" in msg_attributes) and \
                     ("base" in msg_attributes):
-                logger.debug(f'exchange: {exchange_name} msg: {message_body}')
+                logger.debug('exchange: %s msg: %s', exchange_name, message_body)
                 base = [message_body["base"][0], message_body["base"][1]]
                 shoulder = [message_body["shoulder"][0], message_body["shoulder"][1]]
                 elbow = [message_body["elbow"][0], message_body["elbow"][1]]
                 wrist = [message_body["wrist"][0], message_body["wrist"][1]]
-                self.robots.update(id=message_body["id"],
-                                   base=base,
-                                   shoulder=shoulder,
-                                   elbow=elbow,
-                                   wrist=wrist)
+                timestamp = to_epoch_seconds(message_body.get("timestamp"))
+                self.jitter.push(stream="robot", timestamp=timestamp, apply=self.robots.update,
+                                 entity=message_body["id"], now=self.clock.time(),
+                                 kwargs=dict(id=message_body["id"],
+                                             base=base,
+                                             shoulder=shoulder,
+                                             elbow=elbow,
+                                             wrist=wrist,
+                                             timestamp=timestamp))
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -135,17 +289,21 @@ class WS:
                     ("y_ref_pos" in msg_attributes) and \
                     ("z_ref_pos" in msg_attributes) and \
                     ("timestamp" in msg_attributes):
-                logger.debug(message_body)
+                logger.debug('exchange: %s msg: %s', exchange_name, message_body)
                 ref_position = [message_body["x_ref_pos"], message_body["y_ref_pos"]]
                 uwb_position = [message_body["x_uwb_pos"], message_body["y_uwb_pos"]]
                 est_position = [message_body["x_est_pos"], message_body["y_est_pos"]]
-                self.particles.update(id=message_body["id"],
-                                      ref_position=ref_position,
-                                      uwb_position=uwb_position,
-                                      est_position=est_position,
-                                      radius=5,
-                                      world=message_body["view"],
-                                      ref_heading=message_body['ref_heading'])
+                timestamp = to_epoch_seconds(message_body["timestamp"])
+                self.jitter.push(stream="personnel", timestamp=timestamp, apply=self.particles.update,
+                                 entity=message_body["id"], now=self.clock.time(),
+                                 kwargs=dict(id=message_body["id"],
+                                             ref_position=ref_position,
+                                             uwb_position=uwb_position,
+                                             est_position=est_position,
+                                             radius=5,
+                                             world=message_body["view"],
+                                             ref_heading=message_body['ref_heading'],
+                                             timestamp=timestamp))
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -168,6 +326,13 @@ class WS:
             binding_name = kwargs["binding_name"]
             message_body = json.loads(kwargs["message_body"])
 
+            # messages tagged with the handler of the receiving subscriber only go to that handler
+            handler_name = kwargs.get("handler_name")
+            if handler_name is not None:
+                await getattr(self, handler_name)(exchange_name=exchange_name, binding_name=binding_name,
+                                                  message_body=message_body)
+                return
+
             # check for matching subscriber with exchange and binding name in all subscribers
             for subscriber in self.subscribers:
                 # if subscriber.exchange_name == exchange_name:
@@ -176,7 +341,7 @@ class WS:
                     try:
                         cb = getattr(self, cb_str)
                     except:
-                        logging.critical(f'No Matching handler found for {cb_str}')
+                        logging.critical('No Matching handler found for %s', cb_str)
                         continue
                     if cb is not None:
                         await cb(exchange_name=exchange_name, binding_name=binding_name, message_body=message_body)
@@ -191,18 +356,61 @@ class WS:
             logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
             sys.exit()
 
-    def draw(self):
+    def get_layout_state(self):
+        """
+        Static layout of the workspace for vector-state streaming
+        :return: dictionary with map id, unscaled dimensions, background color and obstacles
+        """
+        state = self.layout.as_state()
+        state["id"] = self.id
+        state["dimensions"] = [self.dimensions[0] / get_scaling_factor(), self.dimensions[1] / get_scaling_factor()]
+        return state
+
+    def get_metrics(self):
+        """
+        Rendering metrics of the workspace
+        :return: dictionary with frame time, level of detail, staleness counts, end-to-end latency and
+                 jitter buffer counters
+        """
+        return {
+            "id": self.id,
+            "frame_time": self.frame_time,
+            "lod_level": self.lod.level,
+            "stale": self.robots.stale_count + self.particles.stale_count,
+            "expired": self.robots.expired_count + self.particles.expired_count,
+            "latency": self.latency.as_dict(),
+            "jitter": self.jitter.as_dict()
+        }
+
+    def draw(self, now=None):
         """
         Draw workspace
         1. Layout
         2. robot
         3. particle
+        :param now: frame time in seconds since epoch (default: workspace clock)
         :return: None
         """
         try:
+            start = time.perf_counter()
+            # all streams are rendered at the common playout time
+            playout_time = self.jitter.release(now=now if now is not None else self.clock.time())
+            entity_count = len(self.robots.robots) + len(self.particles.particles) - \
+                self.robots.expired_count - self.particles.expired_count
+            level = self.lod.update(entity_count=entity_count, frame_time=self.frame_time)
+            view = get_view_rect(self.screen.get_size())
+            self.update_subscriptions(view=view)
+            # keep entities whose labels reach into the view
+            margin = 50 / scale(1.0)
+            view = (view[0] - margin, view[1] - margin, view[2] + margin, view[3] + margin)
+            self.atlas.validate()
             self.layout.draw()
-            self.robots.draw()
-            self.particles.draw()
+            self.robots.draw(level=level, view=view, batch=self.batch, now=playout_time)
+            self.particles.draw(level=level, view=view, batch=self.batch, now=playout_time)
+            self.batch.flush(self.screen)
+            self.frame_time = time.perf_counter() - start
+            if self.publishers:
+                self.publish_events(playout_time=playout_time)
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
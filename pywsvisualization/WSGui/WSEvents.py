@@ -0,0 +1,60 @@
+import logging
+import numpy as np
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+class WSZoneMonitor:
+    """
+    Detects personnel entering and leaving the warn and red zones of robots.
+    The distance of a person is measured from the reference position to the robot base at the
+    rendered positions, the center of the drawn zones, so that events match what is drawn.
+    Only changes of the zone of a (robot, person) pair are reported.
+    """
+    CLEAR = "clear"
+    WARN = "warn"
+    RED = "red"
+
+    def __init__(self):
+        """
+        Initialization of zone monitor
+        """
+        self.zones = {}
+
+    def update(self, robots, particles, timestamp=None):
+        """
+        Zone changes since the last update
+        :param robots: WSRobot list
+        :param particles: WSParticle list
+        :param timestamp: playout time of the frame in seconds since epoch (optional)
+        :return: list of zone violation events
+        """
+        active_robots = [robot for robot in robots if robot.last_seen is not None and not robot.expired]
+        active_particles = [particle for particle in particles if particle.ref_center is not None]
+        zones = {}
+        distances = None
+        if active_robots and active_particles:
+            bases = np.array([robot.base for robot in active_robots], dtype=np.float64)
+            positions = np.array([particle.ref_center for particle in active_particles], dtype=np.float64)
+            # (robots, particles) distance to the zone center
+            distances = np.hypot(bases[:, None, 0] - positions[None, :, 0],
+                                 bases[:, None, 1] - positions[None, :, 1])
+            warn_size = np.array([robot.template.warn_size for robot in active_robots])[:, None]
+            red_size = np.array([robot.template.red_size for robot in active_robots])[:, None]
+            for robot_index, particle_index in zip(*np.nonzero(distances <= warn_size)):
+                zone = self.RED if distances[robot_index, particle_index] <= red_size[robot_index, 0] else self.WARN
+                zones[(active_robots[robot_index].id, active_particles[particle_index].id)] = \
+                    (zone, float(distances[robot_index, particle_index]))
+
+        events = []
+        for pair, (zone, distance) in zones.items():
+            previous = self.zones.get(pair)
+            if previous is None or previous[0] != zone:
+                events.append({"event": "zone_violation", "robot": pair[0], "personnel": pair[1], "zone": zone,
+                               "distance": distance, "timestamp": timestamp})
+        for pair in self.zones.keys() - zones.keys():
+            events.append({"event": "zone_violation", "robot": pair[0], "personnel": pair[1], "zone": self.CLEAR,
+                           "distance": None, "timestamp": timestamp})
+        self.zones = zones
+        return events
@@ -0,0 +1,475 @@
+"""
+Bulk obstacle import from floor plans
+
+Supported sources:
+    - occupancy grid images (PNG, PGM, BMP, ...): outlines of occupied cells
+    - SVG: line, polyline, polygon, rect and path elements (curves are approximated by
+      their end points), with group and element transforms
+    - DXF (ASCII): LINE, LWPOLYLINE and POLYLINE entities of model space
+
+All sources are reduced to wall segments: polylines are simplified (Douglas-Peucker),
+split into segments, and collinear segments that touch or overlap are merged. The
+result is cached as a binary (.npz) file keyed by the source file hash and the import
+parameters, in the configuration cache directory.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import pygame as pg
+from pywsvisualization.import_formats import import_format
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+# bump when the import output changes, so that older caches are not used
+CACHE_VERSION = 2
+
+
+def _runs(mask):
+    """
+    Runs of True along the rows of a 2D mask
+    :param mask: 2D boolean array
+    :return: row, start and end (exclusive) arrays of the runs
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    change = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(change == 1)
+    _, ends = np.nonzero(change == -1)
+    return rows, starts, ends
+
+
+def grid_segments(occupied):
+    """
+    Outline of the occupied cells of a grid as maximal horizontal and vertical segments
+    :param occupied: 2D boolean array (rows, columns)
+    :return: array (N, 4) of x0, y0, x1, y1 in cell units
+    """
+    padded = np.zeros((occupied.shape[0] + 2, occupied.shape[1] + 2), dtype=bool)
+    padded[1:-1, 1:-1] = occupied
+    # boundary between cell rows y-1 and y, and between cell columns x-1 and x
+    horizontal = padded[1:, 1:-1] != padded[:-1, 1:-1]
+    vertical = padded[1:-1, 1:] != padded[1:-1, :-1]
+    y, x0, x1 = _runs(horizontal)
+    h_segments = np.stack([x0, y, x1, y], axis=1)
+    x, y0, y1 = _runs(vertical.T)
+    v_segments = np.stack([x, y0, x, y1], axis=1)
+    return np.concatenate([h_segments, v_segments]).astype(np.float64)
+
+
+def load_grid(path, threshold=128, invert=False):
+    """
+    Wall segments of an occupancy grid image; dark pixels are occupied
+    :param path: image file path
+    :param threshold: gray value below which a pixel is occupied
+    :param invert: light pixels are occupied
+    :return: array (N, 4) of segments in pixel units
+    """
+    pixels = pg.surfarray.array3d(pg.image.load(path)).transpose(1, 0, 2)
+    gray = pixels.mean(axis=2)
+    occupied = gray >= threshold if invert else gray < threshold
+    return grid_segments(occupied)
+
+
+def _transform(value):
+    """
+    SVG transform attribute as 3x3 matrix
+    """
+    matrix = np.identity(3)
+    for name, args in re.findall(r'(\w+)\s*\(([^)]*)\)', value or ""):
+        values = [float(v) for v in re.findall(r'[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?', args)]
+        step = np.identity(3)
+        if name == "matrix" and len(values) == 6:
+            step[0, :] = values[0], values[2], values[4]
+            step[1, :] = values[1], values[3], values[5]
+        elif name == "translate" and values:
+            step[0, 2] = values[0]
+            step[1, 2] = values[1] if len(values) > 1 else 0.0
+        elif name == "scale" and values:
+            step[0, 0] = values[0]
+            step[1, 1] = values[1] if len(values) > 1 else values[0]
+        elif name == "rotate" and values:
+            angle = math.radians(values[0])
+            cx, cy = (values[1], values[2]) if len(values) == 3 else (0.0, 0.0)
+            rotation = np.array([[math.cos(angle), -math.sin(angle), 0.0],
+                                 [math.sin(angle), math.cos(angle), 0.0],
+                                 [0.0, 0.0, 1.0]])
+            to_center = np.identity(3)
+            to_center[:2, 2] = cx, cy
+            from_center = np.identity(3)
+            from_center[:2, 2] = -cx, -cy
+            step = to_center @ rotation @ from_center
+        else:
+            logger.warning('Ignoring unsupported SVG transform %s', name)
+        matrix = matrix @ step
+    return matrix
+
+
+def _numbers(value):
+    return [float(v) for v in re.findall(r'[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?', value or "")]
+
+
+def _path_polylines(d):
+    """
+    Polylines of an SVG path; curves and arcs are replaced by a line to their end point
+    """
+    polylines = []
+    current = []
+    x = y = 0.0
+    start = (0.0, 0.0)
+    # number of arguments per command, the end point is always last
+    arguments = {"m": 2, "l": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4, "t": 2, "a": 7, "z": 0}
+    for command, args in re.findall(r'([MmLlHhVvCcSsQqTtAaZz])([^MmLlHhVvCcSsQqTtAaZz]*)', d or ""):
+        lower = command.lower()
+        relative = command.islower()
+        values = _numbers(args)
+        if lower == "z":
+            if current:
+                current.append(start)
+                polylines.append(current)
+            current = []
+            x, y = start
+            continue
+        count = arguments[lower]
+        for index in range(0, len(values), count):
+            chunk = values[index:index + count]
+            if len(chunk) < count:
+                break
+            if lower == "h":
+                x = x + chunk[0] if relative else chunk[0]
+            elif lower == "v":
+                y = y + chunk[0] if relative else chunk[0]
+            else:
+                end_x, end_y = chunk[-2], chunk[-1]
+                x, y = (x + end_x, y + end_y) if relative else (end_x, end_y)
+            if lower == "m" and index == 0:
+                if len(current) > 1:
+                    polylines.append(current)
+                current = [(x, y)]
+                start = (x, y)
+            else:
+                current.append((x, y))
+    if len(current) > 1:
+        polylines.append(current)
+    return polylines
+
+
+def load_svg(path):
+    """
+    Polylines of an SVG floor plan
+    :param path: SVG file path
+    :return: list of arrays (M, 2) of points in SVG user units
+    """
+    polylines = []
+
+    def visit(element, matrix):
+        matrix = matrix @ _transform(element.get("transform"))
+        tag = element.tag.split("}")[-1]
+        shapes = []
+        if tag == "line":
+            shapes.append([(float(element.get("x1", 0)), float(element.get("y1", 0))),
+                           (float(element.get("x2", 0)), float(element.get("y2", 0)))])
+        elif tag in ("polyline", "polygon"):
+            values = _numbers(element.get("points"))
+            points = list(zip(values[0::2], values[1::2]))
+            if tag == "polygon" and points:
+                points.append(points[0])
+            shapes.append(points)
+        elif tag == "rect":
+            x0, y0 = float(element.get("x", 0)), float(element.get("y", 0))
+            x1, y1 = x0 + float(element.get("width", 0)), y0 + float(element.get("height", 0))
+            shapes.append([(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)])
+        elif tag == "path":
+            shapes.extend(_path_polylines(element.get("d")))
+        for shape in shapes:
+            if len(shape) > 1:
+                points = np.asarray(shape, dtype=np.float64)
+                polylines.append(points @ matrix[:2, :2].T + matrix[:2, 2])
+        for child in element:
+            visit(child, matrix)
+
+    visit(ElementTree.parse(path).getroot(), np.identity(3))
+    return polylines
+
+
+def _dxf_entities(path):
+    """
+    Entities of the ENTITIES section of an ASCII DXF file
+    :return: list of (entity type, list of (group code, value))
+    """
+    with open(path, 'r', errors='replace') as dxf_file:
+        lines = dxf_file.read().splitlines()
+    entities = []
+    section = None
+    current = None
+    for index in range(0, len(lines) - 1, 2):
+        code, value = lines[index].strip(), lines[index + 1].strip()
+        if code == "0":
+            current = None
+            if value == "SECTION":
+                section = ""
+            elif value == "ENDSEC":
+                section = None
+            elif section == "ENTITIES":
+                current = (value, [])
+                entities.append(current)
+        elif code == "2" and section == "":
+            section = value
+        elif current is not None:
+            current[1].append((code, value))
+    return entities
+
+
+def _dxf_points(pairs):
+    points = []
+    x = None
+    for code, value in pairs:
+        if code == "10":
+            x = float(value)
+        elif code == "20" and x is not None:
+            points.append((x, float(value)))
+            x = None
+    return points
+
+
+def load_dxf(path):
+    """
+    Polylines of the model space entities of an ASCII DXF floor plan
+    :param path: DXF file path
+    :return: list of arrays (M, 2) of points in drawing units
+    """
+    polylines = []
+    polyline = None
+    for entity, pairs in _dxf_entities(path):
+        values = dict(pairs)
+        if entity == "LINE":
+            polylines.append(np.array([[float(values.get("10", 0)), float(values.get("20", 0))],
+                                       [float(values.get("11", 0)), float(values.get("21", 0))]]))
+        elif entity == "LWPOLYLINE":
+            points = _dxf_points(pairs)
+            if int(values.get("70", 0)) & 1 and points:
+                points.append(points[0])
+            if len(points) > 1:
+                polylines.append(np.asarray(points, dtype=np.float64))
+        elif entity == "POLYLINE":
+            polyline = ([], bool(int(values.get("70", 0)) & 1))
+        elif entity == "VERTEX" and polyline is not None:
+            polyline[0].extend(_dxf_points(pairs))
+        elif entity == "SEQEND" and polyline is not None:
+            points, closed = polyline
+            if closed and points:
+                points.append(points[0])
+            if len(points) > 1:
+                polylines.append(np.asarray(points, dtype=np.float64))
+            polyline = None
+    return polylines
+
+
+def simplify_polyline(points, tolerance):
+    """
+    Douglas-Peucker simplification
+    :param points: array (M, 2)
+    :param tolerance: largest allowed distance of removed points
+    :return: array of the kept points
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        direction = end - start
+        length = math.hypot(direction[0], direction[1])
+        inner = points[first + 1:last]
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - start[0], inner[:, 1] - start[1])
+        else:
+            cross = direction[0] * (inner[:, 1] - start[1]) - direction[1] * (inner[:, 0] - start[0])
+            distances = np.abs(cross) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+def polyline_segments(polylines, tolerance=0.0):
+    """
+    Simplified polylines as segments
+    :param polylines: list of arrays (M, 2)
+    :param tolerance: simplification tolerance
+    :return: array (N, 4) of segments
+    """
+    segments = []
+    for points in polylines:
+        points = simplify_polyline(np.asarray(points, dtype=np.float64), tolerance)
+        if len(points) > 1:
+            segments.append(np.concatenate([points[:-1], points[1:]], axis=1))
+    if not segments:
+        return np.zeros((0, 4))
+    return np.concatenate(segments)
+
+
+def _clusters(values, gap):
+    """
+    Split values into clusters of neighbours that are at most `gap` apart
+    :param values: 1D array
+    :param gap: largest distance between neighbouring values of a cluster
+    :return: list of index arrays
+    """
+    order = np.argsort(values, kind='stable')
+    return np.split(order, np.nonzero(np.diff(values[order]) > gap)[0] + 1)
+
+
+def _fit_direction(segments):
+    """
+    Length weighted mean direction of segments, opposite directions count as the same line
+    :param segments: array (N, 4) of x0, y0, x1, y1
+    :return: unit vector
+    """
+    delta = segments[:, 2:] - segments[:, :2]
+    lengths = np.hypot(delta[:, 0], delta[:, 1])
+    # doubled angles, so that segments drawn in opposite directions agree
+    angles = 2 * np.arctan2(delta[:, 1], delta[:, 0])
+    angle = 0.5 * math.atan2(float(np.dot(lengths, np.sin(angles))), float(np.dot(lengths, np.cos(angles))))
+    return np.array([math.cos(angle), math.sin(angle)])
+
+
+def merge_collinear(segments, tolerance=0.01, angle_tolerance=0.5):
+    """
+    Merge collinear segments that touch or overlap. Segments are grouped by angle, each group is
+    split into lines by the distance of the segments along the fitted normal of the group, and the
+    segments of a line that touch or overlap are merged.
+    :param segments: array (N, 4) of x0, y0, x1, y1
+    :param tolerance: largest distance between lines and gap between segments that are merged
+    :param angle_tolerance: largest angle difference in degrees between merged segments
+    :return: array (K, 4) of merged segments
+    """
+    segments = np.asarray(segments, dtype=np.float64)
+    delta = segments[:, 2:] - segments[:, :2]
+    segments = segments[np.hypot(delta[:, 0], delta[:, 1]) > 0]
+    if len(segments) == 0:
+        return segments
+    delta = segments[:, 2:] - segments[:, :2]
+    angles = np.mod(np.arctan2(delta[:, 1], delta[:, 0]), np.pi)
+    angle_step = math.radians(angle_tolerance)
+    angle_groups = _clusters(angles, angle_step)
+    # angles close to pi continue the group close to 0
+    if len(angle_groups) > 1 and angles[angle_groups[0][0]] + np.pi - angles[angle_groups[-1][-1]] <= angle_step:
+        angle_groups[0] = np.concatenate([angle_groups.pop(), angle_groups[0]])
+
+    result = []
+    for angle_group in angle_groups:
+        direction = _fit_direction(segments[angle_group])
+        normal = np.array([-direction[1], direction[0]])
+        offsets = segments[angle_group, :2] @ normal
+        for line in _clusters(offsets, tolerance):
+            members = segments[angle_group[line]]
+            t0 = members[:, :2] @ direction
+            t1 = members[:, 2:] @ direction
+            starts = np.minimum(t0, t1)
+            ends = np.maximum(t0, t1)
+            order = np.argsort(starts, kind='stable')
+            run = [order[0]]
+            run_end = ends[order[0]]
+            for index in order[1:]:
+                if starts[index] <= run_end + tolerance:
+                    run.append(index)
+                    run_end = max(run_end, ends[index])
+                    continue
+                result.append(_merged(members[run]))
+                run = [index]
+                run_end = ends[index]
+            result.append(_merged(members[run]))
+    return np.array(result)
+
+
+def _merged(segments):
+    """
+    Single segment covering collinear segments, along their own fitted line
+    :param segments: array (N, 4) of touching or overlapping segments
+    :return: array (4,) of x0, y0, x1, y1
+    """
+    if len(segments) == 1:
+        # unmerged segments keep their exact geometry
+        return segments[0]
+    direction = _fit_direction(segments)
+    normal = np.array([-direction[1], direction[0]])
+    points = segments.reshape(-1, 2)
+    lengths = np.repeat(np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]), 2)
+    offset = float(np.dot(points @ normal, lengths) / lengths.sum())
+    positions = points @ direction
+    base = normal * offset
+    return np.concatenate([base + direction * positions.min(), base + direction * positions.max()])
+
+
+def _cache_path(config, data):
+    from pywsvisualization.config import cache_dir
+    directory = cache_dir()
+    if directory is None:
+        return None
+    parameters = json.dumps({key: value for key, value in config.items() if key not in ("render", "id")},
+                            sort_keys=True, default=str)
+    digest = hashlib.sha256(data + parameters.encode()).hexdigest()
+    return os.path.join(directory, f'import-{digest}.v{CACHE_VERSION}.npz')
+
+
+def import_segments(config):
+    """
+    Wall segments of a floor plan import in map units, from the binary cache if available
+    :param config: import configuration (file, format, scale, offset, tolerance, ...)
+    :return: array (N, 4) of x0, y0, x1, y1
+    """
+    path = config["file"]
+    source_format = import_format(config)
+    if source_format is None:
+        raise ValueError(f'Unknown floor plan format of {path}')
+    with open(path, 'rb') as source:
+        data = source.read()
+    cache_path = _cache_path(config, data)
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                return cached["segments"]
+        except Exception as e:
+            logger.warning('Ignoring unreadable import cache %s: %s', cache_path, e)
+
+    scale = config.get("scale", 1.0)
+    offset = config.get("offset", [0.0, 0.0])
+    tolerance = config.get("tolerance", 0.0)
+    if source_format == "grid":
+        segments = load_grid(path, threshold=config.get("threshold", 128), invert=config.get("invert", False))
+    elif source_format == "svg":
+        segments = polyline_segments(load_svg(path), tolerance=tolerance / scale if scale else 0.0)
+    else:
+        segments = polyline_segments(load_dxf(path), tolerance=tolerance / scale if scale else 0.0)
+    segments = segments * scale + np.array([offset[0], offset[1], offset[0], offset[1]])
+    count = len(segments)
+    segments = merge_collinear(segments, tolerance=max(tolerance, 1e-6),
+                               angle_tolerance=config.get("angle_tolerance", 0.5))
+    min_length = config.get("min_length", 0.0)
+    if min_length > 0 and len(segments):
+        segments = segments[np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]) >= min_length]
+    logger.info('Imported %d wall segments (%d before merging) from %s', len(segments), count, path)
+
+    if cache_path is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+            temp_path = f'{cache_path}.{os.getpid()}.tmp.npz'
+            np.savez(temp_path, segments=segments.astype(np.float64))
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning('Could not store import cache %s: %s', cache_path, e)
+    return segments
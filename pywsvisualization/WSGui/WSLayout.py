@@ -2,29 +2,42 @@ import sys
 import traceback
 import pygame as pg
 import logging
-from .scaling import scale
+from collections import OrderedDict
+from .scaling import get_scaling_factor, get_viewport
+from .WSSpatialIndex import WSSpatialIndex
+from .WSModel import WSObstacle
 
 # logger for this file
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('/tmp/virtualwsgui.log')
-handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(levelname)-8s-[%(filename)s:%(lineno)d]-%(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
 class WSLayout:
-    def __init__(self,config,screen):
+    def __init__(self,config,screen,viewport=None):
         """
         Initialization of workspace layout
-        :param config: configuration file
+        :param config: map model (WSMapModel)
         :param screen: screen object from pygame
+        :param viewport: viewport section of scene attributes (optional)
         """
         try:
+            if viewport is None:
+                viewport = {}
             self.screen = screen
-            self.bg_color = tuple(config["render"]["background_color"])
-            self.obstacles = config["obstacles"]
+            self.bg_color = config.background_color
+            self.dimensions = config.dimensions
+            self.obstacles = [obstacle for obstacle in config.obstacles if obstacle.drawable]
+            # the whole map is cached per zoom level unless it gets larger than this
+            self.max_cache_pixels = viewport.get("max_cache_pixels", 16000000)
+            self.index = WSSpatialIndex(cell_size=viewport.get("index_cell_size", 20))
+            for obstacle in self.obstacles:
+                self.index.insert(obstacle, obstacle.bounds)
+            # maps too large for one cached layer are rendered in tiles; panning only renders new tiles
+            self.tile_size = viewport.get("tile_size", 256)
+            self.max_tiles = viewport.get("max_tiles", 128)
+            self.tiles = OrderedDict()
+            self.tiles_factor = None
+            self.static_layer = None
+            self.static_layer_key = None
         except AssertionError as e:
             logging.critical(e)
             exc_type,exc_value,exc_traceback = sys.exc_info()
@@ -36,6 +49,98 @@ class WSLayout:
             logging.critical(repr(traceback.format_exception(exc_type,exc_value,exc_traceback)))
             sys.exit()
 
+    def as_state(self):
+        """
+        Static layout of the workspace for vector-state streaming
+        :return: dictionary with background color and obstacles
+        """
+        return {
+            "background": list(self.bg_color),
+            "obstacles": [obstacle.as_state() for obstacle in self.obstacles]
+        }
+
+    def _render(self, surface, obstacles, factor, width_factor, origin):
+        """
+        Render obstacles on a surface
+        :param surface: target surface
+        :param obstacles: obstacles to be rendered
+        :param factor: world to pixel factor
+        :param width_factor: line width factor
+        :param origin: pixel position of the surface origin
+        :return: None
+        """
+        surface.fill(self.bg_color)
+        origin_x, origin_y = origin
+        for obstacle in obstacles:
+            width = max(1, round(obstacle.width * width_factor))
+            points = obstacle.pixel_points(factor)
+            if origin_x or origin_y:
+                points = [(x - origin_x, y - origin_y) for x, y in points]
+            if obstacle.shape == WSObstacle.LINE:
+                pg.draw.line(surface=surface, color=obstacle.color, start_pos=points[0], end_pos=points[1], width=width)
+            else:
+                pg.draw.polygon(surface=surface, color=obstacle.color, points=points, width=width)
+
+    def _static_layer(self):
+        """
+        Static layer (background and obstacles) for the current viewport.
+        The whole map is rendered once per zoom level so that panning is a blit; maps that
+        get too large at the current zoom are composed from cached tiles of the visible obstacles.
+        :return: static layer surface and its blit position
+        """
+        zoom, offset = get_viewport()
+        factor = get_scaling_factor() * zoom
+        map_size = (max(1, int(self.dimensions[0] * factor)), max(1, int(self.dimensions[1] * factor)))
+        screen_size = self.screen.get_size()
+        if map_size[0] * map_size[1] <= self.max_cache_pixels:
+            key = ("map", factor)
+            if key != self.static_layer_key:
+                self.static_layer = pg.Surface(map_size)
+                self._render(surface=self.static_layer, obstacles=self.obstacles, factor=factor, width_factor=zoom,
+                             origin=(0, 0))
+                self.static_layer_key = key
+            return self.static_layer, (-offset[0], -offset[1])
+        key = ("view", zoom, offset, screen_size)
+        if key != self.static_layer_key:
+            if self.static_layer is None or self.static_layer.get_size() != screen_size:
+                self.static_layer = pg.Surface(screen_size)
+            self.static_layer.fill(self.bg_color)
+            tile_size = self.tile_size
+            for tile_y in range(int(offset[1] // tile_size), int((offset[1] + screen_size[1]) // tile_size) + 1):
+                for tile_x in range(int(offset[0] // tile_size), int((offset[0] + screen_size[0]) // tile_size) + 1):
+                    tile = self._tile(factor=factor, zoom=zoom, tile_x=tile_x, tile_y=tile_y)
+                    self.static_layer.blit(tile, (tile_x * tile_size - offset[0], tile_y * tile_size - offset[1]))
+            self.static_layer_key = key
+        return self.static_layer, (0, 0)
+
+    def _tile(self, factor, zoom, tile_x, tile_y):
+        """
+        Static layer tile at the current zoom, rendered on first use
+        :param factor: world to pixel factor
+        :param zoom: viewport zoom
+        :param tile_x: tile column
+        :param tile_y: tile row
+        :return: tile surface
+        """
+        if factor != self.tiles_factor:
+            self.tiles.clear()
+            self.tiles_factor = factor
+        key = (tile_x, tile_y)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        tile_size = self.tile_size
+        origin = (tile_x * tile_size, tile_y * tile_size)
+        box = (origin[0] / factor, origin[1] / factor,
+               (origin[0] + tile_size) / factor, (origin[1] + tile_size) / factor)
+        tile = pg.Surface((tile_size, tile_size))
+        self._render(surface=tile, obstacles=self.index.query(box), factor=factor, width_factor=zoom, origin=origin)
+        self.tiles[key] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
     def draw(self):
         """
         Draw Layout in the workspace.
@@ -45,21 +150,9 @@ class WSLayout:
         :return: None
         """
         try:
+            layer, position = self._static_layer()
             self.screen.fill(self.bg_color)
-            for obstacle in self.obstacles:
-                if obstacle["render"]["shape"] == "line" and len(obstacle["points"]) == 2:
-                    startpos = (scale(obstacle["points"][0][0]),scale(obstacle["points"][0][1]))
-                    endpos = (scale(obstacle["points"][1][0]),scale(obstacle["points"][1][1]))
-                    width = obstacle["width"]
-                    pg.draw.line(surface=self.screen,color=(obstacle["render"]["color"][0],obstacle["render"]["color"][1],obstacle["render"]["color"][2]),start_pos=startpos,end_pos=endpos, width=width)
-                elif obstacle["render"]["shape"] == "polygon" and len(obstacle["points"]) > 2:
-                    points = list()
-                    for pt in obstacle["points"]:
-                        points.append([scale(pt[0]),scale(pt[1])])
-                    width = obstacle["width"]
-                    pg.draw.polygon(surface=self.screen,
-                                    color=(obstacle["render"]["color"][0],obstacle["render"]["color"][1],obstacle["render"]["color"][2]),
-                                    points=points, width=width)
+            self.screen.blit(layer, position)
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -70,4 +163,3 @@ class WSLayout:
             exc_type, exc_value, exc_traceback = sys.exc_info()
             logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
             sys.exit()
-
@@ -0,0 +1,102 @@
+import logging
+from .scaling import get_scaling_factor
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+class WSLod:
+    """
+    Level-of-detail policy for workspace rendering.
+    Levels (each level also drops everything dropped by the levels below it):
+        0. FULL: everything is drawn
+        1. NO_RAYS: particle ray casts are suppressed
+        2. NO_LABELS: robot and particle text labels are suppressed
+        3. NO_JOINT_RINGS: white inner rings of robot joints are suppressed
+        4. SKELETON: robots are collapsed to red zone and arm segments
+    """
+    FULL = 0
+    NO_RAYS = 1
+    NO_LABELS = 2
+    NO_JOINT_RINGS = 3
+    SKELETON = 4
+
+    def __init__(self, config=None):
+        """
+        Initialization of level-of-detail policy
+        :param config: `lod` section of scene attributes (optional)
+        """
+        if config is None:
+            config = {}
+        self.enable = config.get("enable", True)
+        # entity counts at which the levels NO_RAYS .. SKELETON are entered
+        self.entity_thresholds = config.get("entity_thresholds", [50, 100, 200, 400])
+        # below this scaling factor labels are unreadable anyway
+        self.min_label_scaling = config.get("min_label_scaling", 2)
+        # frame time budget in seconds
+        self.frame_budget = config.get("frame_budget", 0.02)
+        # number of consecutive frames over/under budget before the level is changed
+        self.patience = config.get("patience", 10)
+        # frame time (fraction of budget) below which detail is restored
+        self.recover_ratio = config.get("recover_ratio", 0.6)
+        self.smoothing = config.get("smoothing", 0.1)
+        self.frame_time = 0.0
+        self.adaptive_level = WSLod.FULL
+        self.level = WSLod.FULL
+        self._over_budget = 0
+        self._under_budget = 0
+
+    def _static_level(self, entity_count):
+        """
+        Level derived from entity count and scaling factor
+        :param entity_count: number of entities to be rendered
+        :return: level
+        """
+        level = WSLod.FULL
+        for threshold in self.entity_thresholds[:WSLod.SKELETON]:
+            if entity_count >= threshold:
+                level += 1
+        if get_scaling_factor() < self.min_label_scaling:
+            level = max(level, WSLod.NO_LABELS)
+        return level
+
+    def _adapt(self, frame_time):
+        """
+        Adjust the adaptive level from the measured frame time
+        :param frame_time: duration of the last frame in seconds
+        :return: None
+        """
+        self.frame_time += self.smoothing * (frame_time - self.frame_time)
+        if self.frame_budget is None:
+            return
+        if self.frame_time > self.frame_budget:
+            self._over_budget += 1
+            self._under_budget = 0
+            if self._over_budget >= self.patience and self.adaptive_level < WSLod.SKELETON:
+                self.adaptive_level += 1
+                self._over_budget = 0
+                logger.info('LOD: frame time %.4fs over budget, level %d', self.frame_time, self.adaptive_level)
+        elif self.frame_time < self.frame_budget * self.recover_ratio:
+            self._under_budget += 1
+            self._over_budget = 0
+            if self._under_budget >= self.patience and self.adaptive_level > WSLod.FULL:
+                self.adaptive_level -= 1
+                self._under_budget = 0
+        else:
+            self._over_budget = 0
+            self._under_budget = 0
+
+    def update(self, entity_count, frame_time=None):
+        """
+        Update level of detail for the next frame
+        :param entity_count: number of entities to be rendered
+        :param frame_time: duration of the last frame in seconds (optional)
+        :return: level of detail
+        """
+        if not self.enable:
+            self.level = WSLod.FULL
+            return self.level
+        if frame_time is not None:
+            self._adapt(frame_time)
+        self.level = min(max(self._static_level(entity_count), self.adaptive_level), WSLod.SKELETON)
+        return self.level
@@ -0,0 +1,206 @@
+import logging
+import os
+import numpy as np
+from .WSSpatialIndex import bounding_box
+from .WSImport import import_segments
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+def _color(value, where):
+    if not isinstance(value, (list, tuple)) or len(value) < 3:
+        raise ValueError(f'{where}: color must have three components')
+    return int(value[0]), int(value[1]), int(value[2])
+
+
+def _number(value, where):
+    if not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f'{where}: expected a non-negative number, got {value!r}')
+    return value
+
+
+class WSObstacle:
+    """
+    Static obstacle of a map (wall or block) with pixel geometry cached per scaling factor
+    """
+    LINE = "line"
+    POLYGON = "polygon"
+
+    __slots__ = ("id", "description", "shape", "color", "width", "points", "bounds", "drawable",
+                 "factor", "scaled_points")
+
+    def __init__(self, id, description, shape, color, width, points, bounds=None):
+        """
+        Initialization of obstacle
+        :param id: obstacle id
+        :param description: obstacle description
+        :param shape: WSObstacle.LINE or WSObstacle.POLYGON
+        :param color: RGB color tuple
+        :param width: line width in pixels at zoom 1
+        :param points: list of (x, y) tuples in map units
+        :param bounds: bounding box, computed from the points if not given
+        """
+        self.id = id
+        self.description = description
+        self.shape = shape
+        self.color = color
+        self.width = width
+        self.points = points
+        # line widths are in pixels, the margin only needs to be roughly right
+        self.bounds = bounds if bounds is not None else bounding_box(points, margin=width)
+        self.drawable = (shape == self.LINE and len(points) == 2) or (shape == self.POLYGON and len(points) > 2)
+        self.factor = None
+        self.scaled_points = None
+
+    @classmethod
+    def from_config(cls, config, where="obstacle"):
+        render = config["render"]
+        shape = render.get("shape")
+        if shape not in (cls.LINE, cls.POLYGON):
+            raise ValueError(f'{where}: unknown shape {shape!r}')
+        points = tuple((float(point[0]), float(point[1])) for point in config.get("points", ()))
+        return cls(id=config["id"],
+                   description=config.get("description", ""),
+                   shape=shape,
+                   color=_color(render.get("color"), where),
+                   width=_number(config.get("width", 1), where),
+                   points=points)
+
+    @classmethod
+    def from_import(cls, config, where="obstacle import"):
+        """
+        Wall obstacles of a floor plan import
+        :param config: import configuration (see WSImport.import_segments) with render and width
+        :param where: configuration path for error messages
+        :return: list of WSObstacle
+        """
+        segments = import_segments(config)
+        color = _color(config.get("render", {}).get("color", (0, 0, 0)), where)
+        width = _number(config.get("width", 1), where)
+        name = config.get("id", os.path.basename(config["file"]))
+        lower = np.minimum(segments[:, :2], segments[:, 2:]) - width
+        upper = np.maximum(segments[:, :2], segments[:, 2:]) + width
+        bounds = np.concatenate([lower, upper], axis=1).tolist()
+        return [cls(id=f'{name}:{index}', description=name, shape=cls.LINE, color=color, width=width,
+                    points=((x0, y0), (x1, y1)), bounds=tuple(box))
+                for index, ((x0, y0, x1, y1), box) in enumerate(zip(segments.tolist(), bounds))]
+
+    def pixel_points(self, factor):
+        """
+        Points scaled to pixels, cached for the last scaling factor
+        :param factor: world to pixel factor
+        :return: list of (x, y) tuples
+        """
+        if factor != self.factor:
+            self.scaled_points = [(x * factor, y * factor) for x, y in self.points]
+            self.factor = factor
+        return self.scaled_points
+
+    def as_state(self):
+        return {"id": self.id, "shape": self.shape, "color": list(self.color), "width": self.width,
+                "points": [list(point) for point in self.points]}
+
+
+class WSRobotTemplate:
+    """
+    Render template of a robot, shared by all robots using the same render configuration
+    """
+    __slots__ = ("color", "base_width", "joint_width", "base_shoulder", "shoulder_elbow", "elbow_wrist",
+                 "warn_size", "warn_color", "red_size", "red_color", "factor", "warn_radius", "red_radius")
+
+    def __init__(self, config, where="robot"):
+        """
+        Initialization of robot template
+        :param config: robot render configuration
+        :param where: configuration path for error messages
+        """
+        self.color = _color(config.get("color"), where)
+        self.base_width = _number(config["base_width"], where)
+        self.joint_width = _number(config["joint_width"], where)
+        self.base_shoulder = _number(config["base_shoulder"], where)
+        self.shoulder_elbow = _number(config["shoulder_elbow"], where)
+        self.elbow_wrist = _number(config.get("elbow_wrist", config["shoulder_elbow"]), where)
+        self.warn_size = _number(config["warn_zone"]["size"], where)
+        self.warn_color = _color(config["warn_zone"]["color"], where)
+        self.red_size = _number(config["red_zone"]["size"], where)
+        self.red_color = _color(config["red_zone"]["color"], where)
+        self.factor = None
+        self.warn_radius = None
+        self.red_radius = None
+
+    def scaled(self, factor):
+        """
+        Update zone radii in pixels if the scaling factor changed
+        :param factor: world to pixel factor
+        :return: None
+        """
+        if factor != self.factor:
+            self.warn_radius = self.warn_size * factor
+            self.red_radius = self.red_size * factor
+            self.factor = factor
+
+
+class WSParticleTemplate:
+    """
+    Render template of a particle, shared by all particles using the same render configuration
+    """
+    __slots__ = ("ref_pos_color", "uwb_pos_color", "est_pos_color", "ray_cast_color", "radius",
+                 "enable_ray_cast_render")
+
+    def __init__(self, config, where="particle"):
+        """
+        Initialization of particle template
+        :param config: particle render configuration
+        :param where: configuration path for error messages
+        """
+        self.ref_pos_color = _color(config.get("ref_pos_color"), where)
+        self.uwb_pos_color = _color(config.get("uwb_pos_color"), where)
+        self.est_pos_color = _color(config.get("est_pos_color"), where)
+        self.ray_cast_color = _color(config.get("ray_cast_color"), where)
+        self.radius = _number(config["size"], where)
+        self.enable_ray_cast_render = bool(config.get("enable_ray_cast_render", False))
+
+
+class WSMapModel:
+    """
+    Compiled map configuration: validated once, consumed by layout, robots and particles
+    """
+    __slots__ = ("id", "dimensions", "type", "background_color", "obstacles", "robots", "particles", "protocol")
+
+    def __init__(self, workspace):
+        """
+        Initialization of map model
+        :param workspace: map configuration
+        """
+        where = f'map {workspace.get("id")}'
+        try:
+            render = workspace["render"]
+            self.id = workspace["id"]
+            self.dimensions = (render["dimensions"][0], render["dimensions"][1])
+            self.type = render.get("type", "2D")
+            self.background_color = _color(render.get("background_color", (255, 255, 255)), where)
+            self.obstacles = [WSObstacle.from_config(obstacle, where=f'{where} obstacle {obstacle.get("id")}')
+                              for obstacle in workspace.get("obstacles") or []]
+            for index, obstacle_import in enumerate(workspace.get("obstacle_imports") or []):
+                self.obstacles.extend(WSObstacle.from_import(obstacle_import,
+                                                             where=f'{where} obstacle import {index}'))
+            # entities that share a render configuration (YAML anchor) share the template
+            templates = {}
+            self.robots = []
+            for robot in workspace.get("robots") or []:
+                template = templates.get(id(robot["render"]))
+                if template is None:
+                    template = WSRobotTemplate(robot["render"], where=f'{where} robot {robot["id"]}')
+                    templates[id(robot["render"])] = template
+                self.robots.append((robot["id"], template))
+            self.particles = []
+            for particle in workspace.get("particles") or []:
+                template = templates.get(id(particle["render"]))
+                if template is None:
+                    template = WSParticleTemplate(particle["render"], where=f'{where} particle {particle["id"]}')
+                    templates[id(particle["render"])] = template
+                self.particles.append((particle["id"], template))
+            self.protocol = workspace.get("protocol", {})
+        except KeyError as e:
+            raise ValueError(f'{where}: missing configuration key {e}') from e
@@ -0,0 +1,224 @@
+import heapq
+import logging
+import time
+import numpy as np
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+class WSInterpolator:
+    """
+    Render-time interpolation of entity positions between the last two timestamped samples.
+    Entities are rendered `delay` seconds in the past so that there is usually a sample on
+    either side of the render time; beyond the latest sample positions are extrapolated with
+    the velocity of the last two samples for at most `max_extrapolation` seconds and then
+    return to the latest sample over the same time, so that an entity that stops reporting
+    comes to rest where it was last seen. All entities of a set are interpolated in one vectorised pass.
+    """
+    def __init__(self, count, points, config=None):
+        """
+        Initialization of interpolator
+        :param count: number of entities
+        :param points: number of tracked points per entity
+        :param config: `interpolation` section of scene attributes (optional)
+        """
+        if config is None:
+            config = {}
+        self.enable = config.get("enable", True)
+        self.delay = config.get("delay", 0.1)
+        self.max_extrapolation = config.get("max_extrapolation", 0.25)
+        self.prev_pos = np.zeros((count, points, 2))
+        self.last_pos = np.zeros((count, points, 2))
+        self.prev_t = np.zeros(count)
+        self.last_t = np.zeros(count)
+        self.samples = np.zeros(count, dtype=np.int8)
+
+    def sample(self, index, positions, timestamp):
+        """
+        Add a sample of an entity
+        :param index: entity index
+        :param positions: list of [x, y] positions of the tracked points
+        :param timestamp: sample time in seconds since epoch
+        :return: None
+        """
+        if self.samples[index] == 0:
+            self.prev_pos[index] = positions
+            self.last_pos[index] = positions
+            self.prev_t[index] = timestamp
+            self.last_t[index] = timestamp
+            self.samples[index] = 1
+            return
+        if timestamp < self.last_t[index]:
+            # out of order sample
+            return
+        if timestamp > self.last_t[index]:
+            self.prev_pos[index] = self.last_pos[index]
+            self.prev_t[index] = self.last_t[index]
+            self.samples[index] = 2
+        self.last_pos[index] = positions
+        self.last_t[index] = timestamp
+
+    def reset(self, index):
+        """
+        Forget the samples of an entity
+        :param index: entity index
+        :return: None
+        """
+        self.samples[index] = 0
+
+    def positions(self, now, hold=None):
+        """
+        Interpolated positions of all entities
+        :param now: current time in seconds since epoch
+        :param hold: boolean mask of entities drawn at their latest sample, e.g. stale ones (optional)
+        :return: array (count, points, 2) of positions and boolean mask of entities with samples
+        """
+        render_time = now - self.delay
+        dt = self.last_t - self.prev_t
+        moving = (self.samples == 2) & (dt > 0)
+        if hold is not None:
+            moving &= ~np.asarray(hold, dtype=bool)
+        safe_dt = np.where(moving, dt, 1.0)
+        # time beyond the latest sample: extrapolate up to max_extrapolation, then return to the sample
+        overshoot = np.maximum(render_time - self.last_t, 0.0)
+        overshoot = np.where(overshoot <= self.max_extrapolation, overshoot,
+                             np.maximum(2 * self.max_extrapolation - overshoot, 0.0))
+        alpha = np.where(render_time > self.last_t, 1.0 + overshoot / safe_dt, (render_time - self.prev_t) / safe_dt)
+        alpha = np.where(moving, np.maximum(alpha, 0.0), 1.0)
+        positions = self.prev_pos + alpha[:, None, None] * (self.last_pos - self.prev_pos)
+        return positions, self.samples > 0
+
+
+class WSJitterBuffer:
+    """
+    Jitter buffer for timestamped telemetry of several streams (robots, personnel).
+    Samples are held until the playout time `now - delay` passes their embedded timestamp and
+    are then released in timestamp order across all streams, so that every stream is rendered
+    at the same playout time. The delay adapts to the lateness observed on the slowest stream:
+    it follows increases at once and decays slowly, bounded by `delay` and `max_delay`.
+    Samples that arrive after the playout time passed their timestamp are still applied if they
+    are newer than the last sample applied for their entity, otherwise they are dropped as late.
+    Samples without usable timestamp (missing, or further than `max_skew` seconds from the
+    local clock) are released immediately.
+    """
+    def __init__(self, config=None):
+        """
+        Initialization of jitter buffer
+        :param config: `jitter` section of scene attributes (optional)
+        """
+        if config is None:
+            config = {}
+        self.enable = config.get("enable", True)
+        self.min_delay = config.get("delay", 0.3)
+        self.max_delay = max(config.get("max_delay", 1.0), self.min_delay)
+        self.margin = config.get("margin", 0.05)
+        self.decay = config.get("decay", 0.01)
+        self.max_depth = config.get("max_depth", 1000)
+        self.max_skew = config.get("max_skew", 5.0)
+        self.delay = self.min_delay
+        self.heap = []
+        self.sequence = 0
+        self.playout_time = None
+        self.lateness = {}
+        self.applied = {}
+        self.depth = {}
+        self.max_seen_depth = {}
+        self.late_applied = {}
+        self.late_drops = {}
+        self.overflow_drops = {}
+        self.untimed = {}
+        self.released = {}
+
+    def _observe(self, stream, lateness):
+        """
+        Track the lateness of a stream and adapt the delay to the slowest stream
+        :param stream: stream name
+        :param lateness: seconds between the sample timestamp and its arrival
+        :return: None
+        """
+        estimate = self.lateness.get(stream, 0.0)
+        if lateness > estimate:
+            estimate = lateness
+        else:
+            estimate += self.decay * (lateness - estimate)
+        self.lateness[stream] = estimate
+        delay = max(self.lateness.values()) + self.margin
+        self.delay = min(max(delay, self.min_delay), self.max_delay)
+
+    def push(self, stream, timestamp, apply, kwargs, entity=None, now=None):
+        """
+        Add a sample
+        :param stream: stream name
+        :param timestamp: sample time in seconds since epoch (None for untimed samples)
+        :param apply: callable applying the sample
+        :param kwargs: keyword arguments of apply
+        :param entity: entity identifier, late samples newer than the last applied one are kept
+        :param now: arrival time in seconds since epoch (default: local clock)
+        :return: None
+        """
+        if now is None:
+            now = time.time()
+        if not self.enable or timestamp is None or abs(timestamp - now) > self.max_skew:
+            if self.enable:
+                self.untimed[stream] = self.untimed.get(stream, 0) + 1
+            apply(**kwargs)
+            return
+        self._observe(stream=stream, lateness=now - timestamp)
+        if self.playout_time is not None and timestamp < self.playout_time:
+            key = (stream, entity)
+            if entity is not None and timestamp > self.applied.get(key, float("-inf")):
+                self.applied[key] = timestamp
+                self.late_applied[stream] = self.late_applied.get(stream, 0) + 1
+                apply(**kwargs)
+            else:
+                self.late_drops[stream] = self.late_drops.get(stream, 0) + 1
+            return
+        if self.depth.get(stream, 0) >= self.max_depth:
+            self.overflow_drops[stream] = self.overflow_drops.get(stream, 0) + 1
+            return
+        self.sequence += 1
+        heapq.heappush(self.heap, (timestamp, self.sequence, stream, entity, apply, kwargs))
+        depth = self.depth.get(stream, 0) + 1
+        self.depth[stream] = depth
+        if depth > self.max_seen_depth.get(stream, 0):
+            self.max_seen_depth[stream] = depth
+
+    def release(self, now):
+        """
+        Apply all samples up to the playout time in timestamp order
+        :param now: current time in seconds since epoch
+        :return: playout time in seconds since epoch
+        """
+        if not self.enable:
+            return now
+        playout_time = now - self.delay
+        if self.playout_time is None or playout_time > self.playout_time:
+            self.playout_time = playout_time
+        heap = self.heap
+        while heap and heap[0][0] <= self.playout_time:
+            timestamp, _, stream, entity, apply, kwargs = heapq.heappop(heap)
+            self.depth[stream] -= 1
+            self.released[stream] = self.released.get(stream, 0) + 1
+            if entity is not None:
+                self.applied[(stream, entity)] = timestamp
+            apply(**kwargs)
+        return self.playout_time
+
+    def as_dict(self):
+        """
+        Buffer metrics per stream
+        :return: dictionary with current delay, lateness estimates, current and maximum depth,
+                 late (applied and dropped), overflow, untimed and released counts
+        """
+        return {
+            "delay": self.delay,
+            "lateness": dict(self.lateness),
+            "depth": dict(self.depth),
+            "max_depth": dict(self.max_seen_depth),
+            "late_applied": dict(self.late_applied),
+            "late_drops": dict(self.late_drops),
+            "overflow_drops": dict(self.overflow_drops),
+            "untimed": dict(self.untimed),
+            "released": dict(self.released)
+        }
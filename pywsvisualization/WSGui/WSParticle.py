@@ -1,98 +1,119 @@
 import random
 import sys
+import time
 import traceback
-import pygame as pg
 import logging, math, random
-from .scaling import scale
+from .scaling import to_screen
+from .WSSpatialIndex import bounding_box, intersects
+from .WSSprites import WSSpriteAtlas, WSSpriteBatch
+from .WSMotion import WSInterpolator
+from .WSLod import WSLod
+from .WSStaleness import WSStaleness, WSLatency, to_epoch_seconds
 
 # logger for this file
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('/tmp/virtualwsgui.log')
-handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(levelname)-8s-[%(filename)s:%(lineno)d]-%(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
 class WSParticle:
-    def __init__(self, id, ref_pos_color, uwb_pos_color, est_pos_color, ray_cast_color, center, radius,
-                 enable_ray_cast_render):
+    def __init__(self, id, template, center):
         """
         Initialization of Particle (personnel as a point object)
         :param id: personnel ID
-        :param ref_pos_color: reference true position color
-        :param uwb_pos_color: uwb position color
-        :param est_pos_color: estimated position color
-        :param ray_cast_color: ray cast ray's colour
+        :param template: render template (WSParticleTemplate)
         :param center: center coordinates of the particle
-        :param radius: radius of the particle
         """
         self.id = id
-        self.ref_pos_color = ref_pos_color
-        self.uwb_pos_color = uwb_pos_color
-        self.est_pos_color = est_pos_color
-        self.ray_cast_color = ray_cast_color
-        self.enable_ray_cast_render = enable_ray_cast_render
+        self.template = template
+        self.label = "P_" + str(id)
         self.ref_center = center
         self.uwb_center = center
         self.est_center = center
-        self.radius = radius
+        # latest reported positions (reference, uwb, estimated); the attributes above are rendered positions
+        self.sample = [center, center, center]
+        self.radius = template.radius
         self.world_view = None
         self.ref_heading = None
+        self.last_seen = None
+        self.timestamp = None
+        self.latency_pending = False
+        self.version = 0
 
-    def draw_text_label(self, screen, text, coordinates):
-        try:
-            _center_x = scale(coordinates[0])
-            _center_y = scale(coordinates[1])
-            font = pg.font.Font(None, 15)
-            font_color = (0, 0, 0)
-            font_background = (255, 255, 255, 1)
-            t = font.render(text, True, font_color, font_background)
-            t_rect = t.get_rect()
-            t_rect.centerx, t_rect.centery = _center_x, _center_y + 15 + 3
-            screen.blit(t, t_rect)
-        except AssertionError as e:
-            logger.error(f'Robot: draw_text_label: failed: {self.id}')
-            traceback.print_exc()
-        except Exception as e:
-            logger.error(f'Robot: draw_text_label: failed: {self.id}')
-            traceback.print_exc()
+    def evict(self):
+        """
+        Evict particle from the render set after it stopped reporting
+        :return: None
+        """
+        self.ref_center = None
+        self.uwb_center = None
+        self.est_center = None
+        self.sample = [None, None, None]
+        self.world_view = None
+        self.ref_heading = None
+        self.latency_pending = False
+        self.version += 1
 
-    def draw(self, screen):
+    def as_state(self):
+        """
+        Compact state of the particle for vector-state streaming. Reported, not interpolated positions
+        are streamed: they only change with a new sample, when the version is bumped.
+        :return: dictionary with reference, uwb and estimated positions and heading or None if not reported
+        """
+        ref_center, uwb_center, est_center = self.sample
+        if ref_center is None:
+            return None
+        return {"r": ref_center, "u": uwb_center, "e": est_center, "h": self.ref_heading}
+
+    def bounds(self, with_rays=False):
+        """
+        World bounding box of the particle
+        :param with_rays: include ray cast contact points
+        :return: (x_min, y_min, x_max, y_max)
+        """
+        points = [self.ref_center, self.uwb_center, self.est_center]
+        if with_rays and self.world_view is not None:
+            points.extend(ray["contact_point"] for ray in self.world_view)
+        return bounding_box(points, margin=2)
+
+    def draw(self, batch, level=WSLod.FULL, dim=None):
         """
         Draw visualization of particle
-        :param screen: screen object from pygame
+        :param batch: sprite batch of the current frame
+        :param level: level of detail (see WSLod)
+        :param dim: color dimming function for stale particles (optional)
         :return: None
         """
         try:
+            template = self.template
+            ref_pos_color = template.ref_pos_color
+            uwb_pos_color = template.uwb_pos_color
+            est_pos_color = template.est_pos_color
+            ray_cast_color = template.ray_cast_color
+            heading_color = (0, 0, 0)
+            if dim is not None:
+                ref_pos_color = dim(ref_pos_color)
+                uwb_pos_color = dim(uwb_pos_color)
+                est_pos_color = dim(est_pos_color)
+                ray_cast_color = dim(ray_cast_color)
+                heading_color = dim(heading_color)
             if self.ref_center is not None and self.uwb_center is not None and self.est_center is not None:
-                if self.world_view is not None and self.enable_ray_cast_render:
+                atlas = batch.atlas
+                ref_center = to_screen(self.ref_center)
+                if self.world_view is not None and template.enable_ray_cast_render and level < WSLod.NO_RAYS:
                     for ray in self.world_view:
-                        pg.draw.line(surface=screen, color=self.ray_cast_color, start_pos=scale(self.ref_center),
-                                     end_pos=scale(ray["contact_point"]), width=1)
-                pg.draw.circle(surface=screen,
-                               color=self.uwb_pos_color,
-                               center=scale(self.uwb_center),
-                               radius=self.radius)
-                pg.draw.circle(surface=screen,
-                               color=self.ref_pos_color,
-                               center=scale(self.ref_center),
-                               radius=self.radius)
-                pg.draw.circle(surface=screen,
-                               color=self.est_pos_color,
-                               center=scale(self.est_center),
-                               radius=self.radius)
-                self.draw_text_label(screen=screen, coordinates=[self.ref_center[0], self.ref_center[1]],
-                                     text="P_" + str(self.id))
+                        batch.line(ray_cast_color, ref_center, to_screen(ray["contact_point"]), 1)
+                batch.marker(atlas.disc(uwb_pos_color, self.radius), to_screen(self.uwb_center))
+                batch.marker(atlas.disc(ref_pos_color, self.radius), ref_center)
+                batch.marker(atlas.disc(est_pos_color, self.radius), to_screen(self.est_center))
+                if level < WSLod.NO_LABELS:
+                    batch.label(atlas.label(self.label, 15, (0, 0, 0), (255, 255, 255)),
+                                (ref_center[0], ref_center[1] + 15 + 3))
                 if self.ref_heading is not None:
-                    num = scale(self.ref_heading['end'])[1] - scale(self.ref_heading['start'])[1]
-                    dem = scale(self.ref_heading['end'])[0] - scale(self.ref_heading['start'])[0]
+                    num = self.ref_heading['end'][1] - self.ref_heading['start'][1]
+                    dem = self.ref_heading['end'][0] - self.ref_heading['start'][0]
                     m = math.atan2(num, dem)
                     end_pos_x = self.ref_center[0] + (math.cos(m) * 2)
                     end_pos_y = self.ref_center[1] + (math.sin(m) * 2)
-                    pg.draw.line(surface=screen, color=(0, 0, 0), start_pos=scale(self.ref_center),
-                                 end_pos=scale([end_pos_x, end_pos_y]), width=3)
+                    batch.overlay_line(heading_color, ref_center, to_screen([end_pos_x, end_pos_y]), 3)
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -110,32 +131,38 @@ class WSParticles:
     """
     Particles (personnel as a point object) in workspace
     """
-    def __init__(self, config, screen):
+    def __init__(self, config, screen, staleness=None, latency=None, atlas=None, interpolation=None, clock=None):
         """
         Initialization of Particles in Workspace
-        :param config: configuration file path
+        :param config: list of (personnel id, WSParticleTemplate) of the map model
         :param screen: Screen object from pygame
+        :param staleness: staleness policy (optional)
+        :param latency: end-to-end latency tracker (optional)
+        :param atlas: sprite atlas shared by the workspace (optional)
+        :param interpolation: interpolation section of scene attributes (optional)
+        :param clock: clock with time() and monotonic() (default: time module)
         """
         try:
             self.screen = screen
+            self.atlas = atlas if atlas is not None else WSSpriteAtlas()
             self.particles = []
+            self.staleness = staleness if staleness is not None else WSStaleness()
+            self.latency = latency if latency is not None else WSLatency()
+            self.clock = clock if clock is not None else time
+            # playout time of the last frame, untimed samples are placed at it
+            self.playout_time = None
+            self.stale_count = 0
+            self.expired_count = 0
 
             assert self.screen is not None, "Screen does not exists"
-            for particle in config:
-                ref_color = particle["render"]["ref_pos_color"]
-                uwb_color = particle["render"]["uwb_pos_color"]
-                est_color = particle["render"]["est_pos_color"]
-                ray_cast_color = particle["render"]["ray_cast_color"]
-                enable_ray_cast_render = particle["render"]["enable_ray_cast_render"]
-                self.particles.append(WSParticle(id=particle["id"],
-                                                 ref_pos_color=(ref_color[0], ref_color[1], ref_color[2]),
-                                                 uwb_pos_color=(uwb_color[0], uwb_color[1], uwb_color[2]),
-                                                 est_pos_color=(est_color[0], est_color[1], est_color[2]),
-                                                 ray_cast_color=(
-                                                 ray_cast_color[0], ray_cast_color[1], ray_cast_color[2]),
-                                                 center=None,
-                                                 radius=particle["render"]["size"],
-                                                 enable_ray_cast_render=enable_ray_cast_render))
+            self.index = {}
+            for particle_id, template in config:
+                self.index[particle_id] = len(self.particles)
+                self.particles.append(WSParticle(id=particle_id, template=template, center=None))
+            for template in {id(template): template for _, template in config}.values():
+                self.atlas.register_particle(template=template)
+            # reference, uwb and estimated positions are interpolated
+            self.motion = WSInterpolator(count=len(self.particles), points=3, config=interpolation)
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -147,14 +174,57 @@ class WSParticles:
             logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
             sys.exit()
 
-    def draw(self):
+    def draw(self, level=WSLod.FULL, view=None, batch=None, now=None):
         """
         Draw particles. This method draw all particles one by one
+        :param level: level of detail (see WSLod)
+        :param view: visible world bounding box, particles outside are culled (optional)
+        :param batch: sprite batch of the current frame, flushed by the caller (optional)
+        :param now: playout time in seconds since epoch for interpolation (default: current time)
         :return: None
         """
         try:
-            for particle in self.particles:
-                particle.draw(self.screen)
+            flush = batch is None
+            if flush:
+                self.atlas.validate()
+                batch = WSSpriteBatch(atlas=self.atlas)
+            self.playout_time = now if now is not None else self.clock.time()
+            monotonic_now = self.clock.monotonic()
+            states = [self.staleness.state(last_seen=particle.last_seen, ttl=self.staleness.particle_ttl,
+                                           now=monotonic_now)
+                      for particle in self.particles]
+            if self.motion.enable:
+                # stale particles rest at their last reported position
+                self.interpolate(now=self.playout_time,
+                                 hold=[state == WSStaleness.STALE for state in states])
+            stale_count = 0
+            expired_count = 0
+            for index, particle in enumerate(self.particles):
+                state = states[index]
+                if state == WSStaleness.EXPIRED:
+                    if particle.ref_center is not None:
+                        logger.info('Particle %s expired', particle.id)
+                        particle.evict()
+                        self.motion.reset(index)
+                    expired_count += 1
+                    continue
+                if view is not None and particle.ref_center is not None and particle.uwb_center is not None and \
+                        particle.est_center is not None:
+                    with_rays = particle.template.enable_ray_cast_render and level < WSLod.NO_RAYS
+                    if not intersects(particle.bounds(with_rays=with_rays), view):
+                        continue
+                if state == WSStaleness.STALE:
+                    stale_count += 1
+                    particle.draw(batch, level=level, dim=self.staleness.dim)
+                else:
+                    particle.draw(batch, level=level)
+                if particle.latency_pending:
+                    self.latency.record(timestamp=particle.timestamp, now=self.clock.time())
+                    particle.latency_pending = False
+            self.stale_count = stale_count
+            self.expired_count = expired_count
+            if flush:
+                batch.flush(self.screen)
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -166,8 +236,21 @@ class WSParticles:
             logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
             sys.exit()
 
+    def interpolate(self, now, hold=None):
+        """
+        Move all particles to their interpolated positions at render time
+        :param now: current time in seconds since epoch
+        :param hold: boolean mask of particles drawn at their last reported position (optional)
+        :return: None
+        """
+        positions, valid = self.motion.positions(now=now, hold=hold)
+        positions = positions.tolist()
+        for index, particle in enumerate(self.particles):
+            if valid[index]:
+                particle.ref_center, particle.uwb_center, particle.est_center = positions[index]
+
     def update(self, id, ref_position=None, uwb_position=None, est_position=None, radius=None, world=None,
-               ref_heading=None):
+               ref_heading=None, timestamp=None):
         """
         Update Particle positions ( reference true, uwb position, estimated position)
         :param id: Personnel ID
@@ -177,23 +260,39 @@ class WSParticles:
         :param radius: radius of the particle
         :param world: view of the world around the particle
         :param ref_heading: reference true heading of the particle
+        :param timestamp: message timestamp in seconds since epoch (optional)
         :return: None
         """
         try:
-            for particle in self.particles:
-                if particle.id == id:
-                    if ref_position is not None:
-                        particle.ref_center = ref_position
-                    if uwb_position is not None:
-                        particle.uwb_center = uwb_position
-                    if est_position is not None:
-                        particle.est_center = est_position
-                    if radius is not None:
-                        particle.radius = radius
-                    if world is not None:
-                        particle.world_view = world
-                    if ref_heading is not None:
-                        particle.ref_heading = ref_heading
+            index = self.index.get(id)
+            if index is None:
+                return None
+            particle = self.particles[index]
+            particle.last_seen = self.clock.monotonic()
+            particle.timestamp = to_epoch_seconds(timestamp)
+            particle.latency_pending = particle.timestamp is not None
+            particle.version += 1
+            sample = particle.sample
+            if ref_position is not None:
+                sample[0] = ref_position
+            if uwb_position is not None:
+                sample[1] = uwb_position
+            if est_position is not None:
+                sample[2] = est_position
+            particle.ref_center, particle.uwb_center, particle.est_center = sample
+            if radius is not None:
+                particle.radius = radius
+            if world is not None:
+                particle.world_view = world
+            if ref_heading is not None:
+                particle.ref_heading = ref_heading
+            if particle.ref_center is not None and particle.uwb_center is not None and \
+                    particle.est_center is not None:
+                if particle.timestamp is not None:
+                    timestamp = particle.timestamp
+                else:
+                    timestamp = self.playout_time if self.playout_time is not None else self.clock.time()
+                self.motion.sample(index=index, positions=list(sample), timestamp=timestamp)
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -1,154 +1,154 @@
 import sys
+import time
 import traceback
-import pygame as pg
 import logging
-from .scaling import scale
+from .scaling import scale, to_screen
+from .WSSpatialIndex import bounding_box, intersects
+from .WSSprites import WSSpriteAtlas, WSSpriteBatch
+from .WSMotion import WSInterpolator
+from .WSLod import WSLod
+from .WSStaleness import WSStaleness, WSLatency, to_epoch_seconds
 
 # logger for this file
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('/tmp/virtualwsgui.log')
-handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(levelname)-8s-[%(filename)s:%(lineno)d]-%(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
 class WSRobot:
 
-    def __init__(self, id, color, base, joint_width, base_width, base_shoulder_width,
-                 shoulder_elbow_width, elbow_wrist_width, warn_zone, red_zone):
+    def __init__(self, id, template, base):
         """
         Initialization of Visualization for robots in workspace
 
         :param id: robot id
-        :param color: robot color
+        :param template: render template (WSRobotTemplate)
         :param base: robot base coordinates
-        :param joint_width: robot joints (shoulder, elbow, wrist) radius
-        :param base_width: robot base radius
-        :param base_shoulder_width: width of base-shoulder line segment
-        :param shoulder_elbow_width: width of shoulder-elbow line segment
-        :param elbow_wrist_width: width of elbow-wrist line segment
         """
         self.id = id
-        self.color = color
+        self.template = template
+        self.label = "robot_" + str(id)
         self.base = base
         self.shoulder = base
         self.elbow = base
         self.wrist = base
-        self.joint_width = joint_width
-        self.base_width = base_width
-        self.base_shoulder_width = base_shoulder_width
-        self.shoulder_elbow_width = shoulder_elbow_width
-        self.elbow_wrist_width = elbow_wrist_width
-        self.warn_zone = warn_zone
-        self.red_zone = red_zone
-
-    def draw_text_label(self, screen, text, coordinates):
-        try:
-            _center_x = scale(coordinates[0])
-            _center_y = scale(coordinates[1])
-            font = pg.font.Font(None, 20)
-            font_color = (0, 0, 0)
-            font_background = pg.Color(self.warn_zone["color"]) #(255, 255, 255, 1)
-            t = font.render(text, True, font_color, font_background)
-            t_rect = t.get_rect()
-            t_rect.centerx, t_rect.centery = _center_x, _center_y + 20 + 20
-            screen.blit(t, t_rect)
-        except AssertionError as e:
-            logger.error(f'Robot: draw_text_label: failed: {self.id}')
-            traceback.print_exc()
-        except Exception as e:
-            logger.error(f'Robot: draw_text_label: failed: {self.id}')
-            traceback.print_exc()
+        # latest reported positions (base, shoulder, elbow, wrist); the attributes above are rendered positions
+        self.sample = [base, base, base, base]
+        self.last_seen = None
+        self.timestamp = None
+        self.latency_pending = False
+        self.expired = False
+        self.version = 0
 
-    def draw(self, screen):
+    def evict(self):
         """
-        Draw Robot Visualization
-        :param screen: rendering screen object from pygame
+        Evict robot from the render set after it stopped reporting
         :return: None
         """
-        pg.draw.circle(surface=screen,
-                       color=pg.Color(self.warn_zone["color"]),
-                       center=scale(self.base),
-                       radius=scale(self.warn_zone["size"]))
-
-        pg.draw.circle(surface=screen,
-                       color=pg.Color(self.red_zone["color"]),
-                       center=scale(self.base),
-                       radius=scale(self.red_zone["size"]))
-
-        self.draw_text_label(screen=screen, coordinates=[self.base[0], self.base[1]], text="robot_" + str(self.id))
+        self.expired = True
+        self.latency_pending = False
+        self.version += 1
 
-        pg.draw.line(surface=screen,
-                     color=self.color,
-                     start_pos=scale(self.base),
-                     end_pos=scale(self.shoulder),
-                     width=self.base_shoulder_width)
+    def as_state(self):
+        """
+        Compact state of the robot for vector-state streaming. Reported, not interpolated positions
+        are streamed: they only change with a new sample, when the version is bumped.
+        :return: dictionary with base, shoulder, elbow and wrist coordinates or None if evicted
+        """
+        if self.expired:
+            return None
+        base, shoulder, elbow, wrist = self.sample
+        return {"b": base, "s": shoulder, "e": elbow, "w": wrist}
 
-        pg.draw.line(surface=screen,
-                     color=self.color,
-                     start_pos=scale(self.shoulder),
-                     end_pos=scale(self.elbow),
-                     width=self.shoulder_elbow_width)
+    def bounds(self):
+        """
+        World bounding box of the robot including its warn zone
+        :return: (x_min, y_min, x_max, y_max)
+        """
+        return bounding_box([self.base, self.shoulder, self.elbow, self.wrist], margin=self.template.warn_size)
 
-        pg.draw.line(surface=screen,
-                     color=self.color,
-                     start_pos=scale(self.elbow),
-                     end_pos=scale(self.wrist),
-                     width=self.elbow_wrist_width)
+    def draw(self, batch, level=WSLod.FULL, dim=None):
+        """
+        Draw Robot Visualization
+        :param batch: sprite batch of the current frame
+        :param level: level of detail (see WSLod)
+        :param dim: color dimming function for stale robots (optional)
+        :return: None
+        """
+        atlas = batch.atlas
+        template = self.template
+        color = template.color
+        warn_color = template.warn_color
+        red_color = template.red_color
+        ring_color = (255, 255, 255)
+        if dim is not None:
+            color = dim(color)
+            warn_color = dim(warn_color)
+            red_color = dim(red_color)
+            ring_color = dim(ring_color)
 
-        pg.draw.circle(surface=screen,
-                       color=self.color,
-                       center=scale(self.base),
-                       radius=self.base_width)
+        base = to_screen(self.base)
+        shoulder = to_screen(self.shoulder)
+        elbow = to_screen(self.elbow)
+        wrist = to_screen(self.wrist)
 
-        pg.draw.circle(surface=screen,
-                       color=self.color,
-                       center=scale(self.shoulder),
-                       radius=self.joint_width)
+        if level < WSLod.SKELETON:
+            batch.zone(atlas.zone(warn_color, template.warn_radius, red_color, template.red_radius), base)
+        else:
+            batch.zone(atlas.zone(None, 0, red_color, template.red_radius), base)
 
-        pg.draw.circle(surface=screen,
-                       color=(255, 255, 255),
-                       center=scale(self.shoulder),
-                       radius=self.joint_width / 2)
+        if level < WSLod.NO_LABELS:
+            batch.label(atlas.label(self.label, 20, (0, 0, 0), warn_color), (base[0], base[1] + 20 + 20))
 
-        pg.draw.circle(surface=screen, color=self.color, center=scale(self.elbow), radius=self.joint_width)
-        pg.draw.circle(surface=screen, color=(255, 255, 255), center=scale(self.elbow),
-                       radius=self.joint_width / 2)
+        batch.line(color, base, shoulder, template.base_shoulder)
+        batch.line(color, shoulder, elbow, template.shoulder_elbow)
+        batch.line(color, elbow, wrist, template.elbow_wrist)
 
-        pg.draw.circle(surface=screen, color=self.color, center=scale(self.wrist), radius=self.joint_width)
-        pg.draw.circle(surface=screen, color=(255, 255, 255), center=scale(self.wrist),
-                       radius=self.joint_width / 2)
+        if level >= WSLod.SKELETON:
+            return
 
+        batch.marker(atlas.disc(color, template.base_width), base)
+        if level < WSLod.NO_JOINT_RINGS:
+            joint_sprite = atlas.ring(color, template.joint_width, ring_color, template.joint_width / 2)
+        else:
+            joint_sprite = atlas.disc(color, template.joint_width)
+        batch.marker(joint_sprite, shoulder)
+        batch.marker(joint_sprite, elbow)
+        batch.marker(joint_sprite, wrist)
 
 
 class WSRobots:
-    def __init__(self, config, screen):
+    def __init__(self, config, screen, staleness=None, latency=None, atlas=None, interpolation=None, clock=None):
         """
         Intialization of all robots in workspace
-        :param config: configuration file path
+        :param config: list of (robot id, WSRobotTemplate) of the map model
         :param screen: pygame screen object
+        :param staleness: staleness policy (optional)
+        :param latency: end-to-end latency tracker (optional)
+        :param atlas: sprite atlas shared by the workspace (optional)
+        :param interpolation: interpolation section of scene attributes (optional)
+        :param clock: clock with time() and monotonic() (default: time module)
         """
         try:
             self.screen = screen
+            self.atlas = atlas if atlas is not None else WSSpriteAtlas()
             self.robots = []
+            self.staleness = staleness if staleness is not None else WSStaleness()
+            self.latency = latency if latency is not None else WSLatency()
+            self.clock = clock if clock is not None else time
+            # playout time of the last frame, untimed samples are placed at it
+            self.playout_time = None
+            self.stale_count = 0
+            self.expired_count = 0
             assert self.screen is not None, "Screen does not exists"
-            for robot in config:
-                self.robots.append(WSRobot(id=robot["id"],
-                                           color=(robot["render"]["color"][0], robot["render"]["color"][1],
-                                                  robot["render"]["color"][2]),
-                                           base=[0, 0],
-                                           joint_width=robot["render"]["joint_width"],
-                                           base_width=robot["render"]["base_width"],
-                                           base_shoulder_width=robot["render"]["base_shoulder"],
-                                           shoulder_elbow_width=robot["render"]["shoulder_elbow"],
-                                           elbow_wrist_width=robot["render"]["shoulder_elbow"],
-                                           warn_zone=robot["render"]["warn_zone"],
-                                           red_zone=robot["render"]["red_zone"]
-                                           ))
-            for robot in self.robots:
-                robot.draw(screen=screen)
+            self.index = {}
+            for robot_id, template in config:
+                self.index[robot_id] = len(self.robots)
+                self.robots.append(WSRobot(id=robot_id, template=template, base=[0, 0]))
+            self.templates = list({id(template): template for _, template in config}.values())
+            # base, shoulder, elbow and wrist are interpolated
+            self.motion = WSInterpolator(count=len(self.robots), points=4, config=interpolation)
+            for template in self.templates:
+                self.atlas.register_robot(template=template)
+            self.draw()
         except AssertionError as e:
             logging.critical(e)
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -160,12 +160,71 @@ class WSRobots:
             logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
             sys.exit()
 
-    def draw(self):
-        for robot in self.robots:
-            robot.draw(screen=self.screen)
+    def draw(self, level=WSLod.FULL, view=None, batch=None, now=None):
+        """
+        Draw all robots in workspace
+        :param level: level of detail (see WSLod)
+        :param view: visible world bounding box, robots outside are culled (optional)
+        :param batch: sprite batch of the current frame, flushed by the caller (optional)
+        :param now: playout time in seconds since epoch for interpolation (default: current time)
+        :return: None
+        """
+        flush = batch is None
+        if flush:
+            self.atlas.validate()
+            batch = WSSpriteBatch(atlas=self.atlas)
+        factor = scale(1.0)
+        for template in self.templates:
+            template.scaled(factor)
+        self.playout_time = now if now is not None else self.clock.time()
+        monotonic_now = self.clock.monotonic()
+        states = [self.staleness.state(last_seen=robot.last_seen, ttl=self.staleness.robot_ttl, now=monotonic_now)
+                  for robot in self.robots]
+        if self.motion.enable:
+            # stale robots rest at their last reported position
+            self.interpolate(now=self.playout_time,
+                             hold=[state == WSStaleness.STALE for state in states])
+        stale_count = 0
+        expired_count = 0
+        for index, robot in enumerate(self.robots):
+            state = states[index]
+            if state == WSStaleness.EXPIRED:
+                if not robot.expired:
+                    logger.info('Robot %s expired', robot.id)
+                    robot.evict()
+                    self.motion.reset(index)
+                expired_count += 1
+                continue
+            if view is not None and not intersects(robot.bounds(), view):
+                continue
+            if state == WSStaleness.STALE:
+                stale_count += 1
+                robot.draw(batch=batch, level=level, dim=self.staleness.dim)
+            else:
+                robot.draw(batch=batch, level=level)
+            if robot.latency_pending:
+                self.latency.record(timestamp=robot.timestamp, now=self.clock.time())
+                robot.latency_pending = False
+        self.stale_count = stale_count
+        self.expired_count = expired_count
+        if flush:
+            batch.flush(self.screen)
         return None
 
-    def update(self, id, base=None, shoulder=None, elbow=None, wrist=None):
+    def interpolate(self, now, hold=None):
+        """
+        Move all robots to their interpolated positions at render time
+        :param now: current time in seconds since epoch
+        :param hold: boolean mask of robots drawn at their last reported position (optional)
+        :return: None
+        """
+        positions, valid = self.motion.positions(now=now, hold=hold)
+        positions = positions.tolist()
+        for index, robot in enumerate(self.robots):
+            if valid[index]:
+                robot.base, robot.shoulder, robot.elbow, robot.wrist = positions[index]
+
+    def update(self, id, base=None, shoulder=None, elbow=None, wrist=None, timestamp=None):
         """
         Visualization of shoulder-elbow line segmentation Update method for all robots in workspace
         :param id: robot id
@@ -173,16 +232,31 @@ class WSRobots:
         :param shoulder: shoulder coordinate of the robot
         :param elbow: elbow coordinate of the robot
         :param wrist: wrist coordinate of the robot
+        :param timestamp: message timestamp in seconds since epoch (optional)
         :return: None
         """
-        for robot in self.robots:
-            if robot.id == id:
-                if shoulder is not None:
-                    robot.shoulder = shoulder
-                if elbow is not None:
-                    robot.elbow = elbow
-                if base is not None:
-                    robot.base = base
-                if wrist is not None:
-                    robot.wrist = wrist
+        index = self.index.get(id)
+        if index is None:
+            return None
+        robot = self.robots[index]
+        robot.last_seen = self.clock.monotonic()
+        robot.timestamp = to_epoch_seconds(timestamp)
+        robot.latency_pending = robot.timestamp is not None
+        robot.expired = False
+        robot.version += 1
+        sample = robot.sample
+        if base is not None:
+            sample[0] = base
+        if shoulder is not None:
+            sample[1] = shoulder
+        if elbow is not None:
+            sample[2] = elbow
+        if wrist is not None:
+            sample[3] = wrist
+        robot.base, robot.shoulder, robot.elbow, robot.wrist = sample
+        if robot.timestamp is not None:
+            timestamp = robot.timestamp
+        else:
+            timestamp = self.playout_time if self.playout_time is not None else self.clock.time()
+        self.motion.sample(index=index, positions=list(sample), timestamp=timestamp)
         return None
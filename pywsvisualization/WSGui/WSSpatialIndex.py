@@ -0,0 +1,82 @@
+import logging
+import math
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+def bounding_box(points, margin=0.0):
+    """
+    Bounding box of a point sequence
+    :param points: sequence of [x, y] coordinates
+    :param margin: margin added on every side
+    :return: (x_min, y_min, x_max, y_max)
+    """
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return min(xs) - margin, min(ys) - margin, max(xs) + margin, max(ys) + margin
+
+
+def intersects(box_a, box_b):
+    """
+    Check whether two bounding boxes overlap
+    :param box_a: (x_min, y_min, x_max, y_max)
+    :param box_b: (x_min, y_min, x_max, y_max)
+    :return: True if the boxes overlap
+    """
+    return box_a[0] <= box_b[2] and box_b[0] <= box_a[2] and box_a[1] <= box_b[3] and box_b[1] <= box_a[3]
+
+
+class WSSpatialIndex:
+    """
+    Uniform grid index of bounding boxes in world coordinates
+    """
+    def __init__(self, cell_size=20.0):
+        """
+        Initialization of spatial index
+        :param cell_size: grid cell size in world units
+        """
+        self.cell_size = cell_size
+        self.cells = {}
+        self.boxes = []
+        self.items = []
+
+    def _cells(self, box):
+        x0 = math.floor(box[0] / self.cell_size)
+        y0 = math.floor(box[1] / self.cell_size)
+        x1 = math.floor(box[2] / self.cell_size)
+        y1 = math.floor(box[3] / self.cell_size)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                yield cx, cy
+
+    def insert(self, item, box):
+        """
+        Insert an item
+        :param item: indexed item
+        :param box: bounding box (x_min, y_min, x_max, y_max) of the item
+        :return: None
+        """
+        index = len(self.items)
+        self.items.append(item)
+        self.boxes.append(box)
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, []).append(index)
+
+    def query(self, box):
+        """
+        Items whose bounding box overlaps the given box, in insertion order
+        :param box: bounding box (x_min, y_min, x_max, y_max)
+        :return: list of items
+        """
+        found = set()
+        cell_count = (math.floor(box[2] / self.cell_size) - math.floor(box[0] / self.cell_size) + 1) * \
+                     (math.floor(box[3] / self.cell_size) - math.floor(box[1] / self.cell_size) + 1)
+        if cell_count > len(self.cells):
+            # box covers more cells than are populated: a linear scan is cheaper
+            return [item for item, item_box in zip(self.items, self.boxes) if intersects(item_box, box)]
+        for cell in self._cells(box):
+            for index in self.cells.get(cell, ()):
+                if index not in found and intersects(self.boxes[index], box):
+                    found.add(index)
+        return [self.items[index] for index in sorted(found)]
@@ -0,0 +1,198 @@
+import logging
+import math
+import pygame as pg
+from .scaling import scale
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+class WSSpriteAtlas:
+    """
+    Pre-rasterised markers (zones, joints, particle positions) and text labels.
+    Sprites depend on the current scaling factor and zoom; the atlas is rebuilt
+    from the registered render templates whenever they change.
+    """
+    def __init__(self):
+        """
+        Initialization of sprite atlas
+        """
+        self.sprites = {}
+        self.labels = {}
+        self.fonts = {}
+        self.robot_templates = set()
+        self.particle_templates = set()
+        self.factor = None
+
+    def register_robot(self, template):
+        """
+        Register a robot render template
+        :param template: WSRobotTemplate
+        :return: None
+        """
+        self.robot_templates.add(template)
+        self.factor = None
+
+    def register_particle(self, template):
+        """
+        Register a particle render template
+        :param template: WSParticleTemplate
+        :return: None
+        """
+        self.particle_templates.add(template)
+        self.factor = None
+
+    def validate(self):
+        """
+        Rebuild the atlas if scaling factor or zoom changed since it was built
+        :return: None
+        """
+        factor = scale(1.0)
+        if factor == self.factor:
+            return
+        self.factor = factor
+        self.sprites = {}
+        for template in self.robot_templates:
+            template.scaled(factor)
+            self.zone(template.warn_color, template.warn_radius, template.red_color, template.red_radius)
+            self.zone(None, 0, template.red_color, template.red_radius)
+            self.disc(template.color, template.base_width)
+            self.disc(template.color, template.joint_width)
+            self.ring(template.color, template.joint_width, (255, 255, 255), template.joint_width / 2)
+        for template in self.particle_templates:
+            for color in (template.ref_pos_color, template.uwb_pos_color, template.est_pos_color):
+                self.disc(color, template.radius)
+
+    @staticmethod
+    def _surface(radius):
+        size = 2 * math.ceil(radius) + 1
+        return pg.Surface((size, size), pg.SRCALPHA), (size // 2, size // 2)
+
+    def disc(self, color, radius):
+        """
+        Filled circle sprite
+        :param color: RGB color
+        :param radius: radius in pixels
+        :return: sprite surface (blit centered)
+        """
+        key = ("disc", tuple(color), radius)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite, center = self._surface(radius)
+            pg.draw.circle(surface=sprite, color=color, center=center, radius=radius)
+            self.sprites[key] = sprite
+        return sprite
+
+    def ring(self, color, radius, inner_color, inner_radius):
+        """
+        Joint sprite: filled circle with an inner circle
+        :param color: RGB color of the outer circle
+        :param radius: outer radius in pixels
+        :param inner_color: RGB color of the inner circle
+        :param inner_radius: inner radius in pixels
+        :return: sprite surface (blit centered)
+        """
+        key = ("ring", tuple(color), radius, tuple(inner_color), inner_radius)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite, center = self._surface(radius)
+            pg.draw.circle(surface=sprite, color=color, center=center, radius=radius)
+            pg.draw.circle(surface=sprite, color=inner_color, center=center, radius=inner_radius)
+            self.sprites[key] = sprite
+        return sprite
+
+    def zone(self, warn_color, warn_radius, red_color, red_radius):
+        """
+        Robot zone sprite: warn zone with red zone on top
+        :param warn_color: RGB color of warn zone (None to leave it out)
+        :param warn_radius: warn zone radius in pixels
+        :param red_color: RGB color of red zone
+        :param red_radius: red zone radius in pixels
+        :return: sprite surface (blit centered)
+        """
+        key = ("zone", None if warn_color is None else tuple(warn_color), warn_radius, tuple(red_color), red_radius)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite, center = self._surface(max(warn_radius, red_radius))
+            if warn_color is not None:
+                pg.draw.circle(surface=sprite, color=warn_color, center=center, radius=warn_radius)
+            pg.draw.circle(surface=sprite, color=red_color, center=center, radius=red_radius)
+            self.sprites[key] = sprite
+        return sprite
+
+    def label(self, text, size, color, background):
+        """
+        Text label sprite
+        :param text: label text
+        :param size: font size
+        :param color: RGB font color
+        :param background: RGB background color
+        :return: sprite surface (blit centered)
+        """
+        key = (text, size, tuple(color), tuple(background[:3]))
+        sprite = self.labels.get(key)
+        if sprite is None:
+            font = self.fonts.get(size)
+            if font is None:
+                font = pg.font.Font(None, size)
+                self.fonts[size] = font
+            sprite = font.render(text, True, color, background)
+            self.labels[key] = sprite
+        return sprite
+
+
+class WSSpriteBatch:
+    """
+    Per-frame draw list. Sprites are collected in layers and drawn with one
+    Surface.blits call per layer; lines are drawn between the layers.
+    Layers (bottom to top): zones, lines, markers, labels, overlay lines
+    """
+    def __init__(self, atlas):
+        """
+        Initialization of sprite batch
+        :param atlas: WSSpriteAtlas
+        """
+        self.atlas = atlas
+        self.zones = []
+        self.lines = []
+        self.markers = []
+        self.labels = []
+        self.overlay_lines = []
+
+    @staticmethod
+    def _centered(sprite, position):
+        return sprite, (position[0] - sprite.get_width() // 2, position[1] - sprite.get_height() // 2)
+
+    def zone(self, sprite, position):
+        self.zones.append(self._centered(sprite, position))
+
+    def marker(self, sprite, position):
+        self.markers.append(self._centered(sprite, position))
+
+    def label(self, sprite, position):
+        self.labels.append(self._centered(sprite, position))
+
+    def line(self, color, start_pos, end_pos, width):
+        self.lines.append((color, start_pos, end_pos, width))
+
+    def overlay_line(self, color, start_pos, end_pos, width):
+        self.overlay_lines.append((color, start_pos, end_pos, width))
+
+    def flush(self, screen):
+        """
+        Draw and clear the batch
+        :param screen: pygame screen object
+        :return: None
+        """
+        screen.blits(self.zones, False)
+        for color, start_pos, end_pos, width in self.lines:
+            pg.draw.line(surface=screen, color=color, start_pos=start_pos, end_pos=end_pos, width=width)
+        screen.blits(self.markers, False)
+        screen.blits(self.labels, False)
+        for color, start_pos, end_pos, width in self.overlay_lines:
+            pg.draw.line(surface=screen, color=color, start_pos=start_pos, end_pos=end_pos, width=width)
+        self.zones.clear()
+        self.lines.clear()
+        self.markers.clear()
+        self.labels.clear()
+        self.overlay_lines.clear()
@@ -0,0 +1,123 @@
+import logging
+import math
+import time
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+def to_epoch_seconds(timestamp):
+    """
+    Normalize a message timestamp to seconds since epoch
+    :param timestamp: timestamp in seconds or milliseconds since epoch
+    :return: timestamp in seconds or None if missing or not numeric (untimed)
+    """
+    if timestamp is None:
+        return None
+    try:
+        timestamp = float(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(timestamp):
+        return None
+    # anything beyond year 5138 in seconds is a millisecond timestamp
+    if timestamp > 1e11:
+        timestamp = timestamp / 1000.0
+    return timestamp
+
+
+class WSStaleness:
+    """
+    Staleness policy for entities that stop reporting.
+    An entity is FRESH until its TTL elapses, then STALE (drawn dimmed) until
+    the expiry TTL elapses, then EXPIRED (evicted from the render set).
+    Entities that never reported are UNSEEN.
+    """
+    UNSEEN = 0
+    FRESH = 1
+    STALE = 2
+    EXPIRED = 3
+
+    def __init__(self, config=None):
+        """
+        Initialization of staleness policy
+        :param config: `staleness` section of scene attributes (optional)
+        """
+        if config is None:
+            config = {}
+        self.enable = config.get("enable", True)
+        self.robot_ttl = config.get("robot_ttl", 2.0)
+        self.particle_ttl = config.get("particle_ttl", 2.0)
+        self.expire_ttl = config.get("expire_ttl", 30.0)
+        self.dim_factor = config.get("dim_factor", 0.35)
+        self.dim_towards = tuple(config.get("dim_towards", [255, 255, 255]))
+
+    def state(self, last_seen, ttl, now=None):
+        """
+        Staleness state of an entity
+        :param last_seen: monotonic time of last update of the entity
+        :param ttl: time to live of the entity in seconds
+        :param now: current monotonic time (optional)
+        :return: UNSEEN, FRESH, STALE or EXPIRED
+        """
+        if last_seen is None:
+            return WSStaleness.UNSEEN
+        if not self.enable:
+            return WSStaleness.FRESH
+        if now is None:
+            now = time.monotonic()
+        age = now - last_seen
+        if age >= self.expire_ttl:
+            return WSStaleness.EXPIRED
+        if age >= ttl:
+            return WSStaleness.STALE
+        return WSStaleness.FRESH
+
+    def dim(self, color):
+        """
+        Dimmed version of a color
+        :param color: RGB color
+        :return: RGB color blended towards the dim color
+        """
+        return tuple(int(c * self.dim_factor + t * (1.0 - self.dim_factor))
+                     for c, t in zip(color[:3], self.dim_towards))
+
+
+class WSLatency:
+    """
+    End-to-end latency (message timestamp to render) tracker
+    """
+    def __init__(self, smoothing=0.1):
+        """
+        Initialization of latency tracker
+        :param smoothing: smoothing factor of the moving average
+        """
+        self.smoothing = smoothing
+        self.last = None
+        self.mean = None
+        self.max = None
+        self.count = 0
+
+    def record(self, timestamp, now=None):
+        """
+        Record latency of a sample on its first render
+        :param timestamp: message timestamp in seconds since epoch
+        :param now: current time in seconds since epoch (optional)
+        :return: None
+        """
+        if timestamp is None:
+            return
+        if now is None:
+            now = time.time()
+        latency = now - timestamp
+        self.last = latency
+        self.mean = latency if self.mean is None else self.mean + self.smoothing * (latency - self.mean)
+        self.max = latency if self.max is None else max(self.max, latency)
+        self.count += 1
+
+    def as_dict(self):
+        """
+        Latency statistics
+        :return: dictionary of latency statistics in seconds
+        """
+        return {"last": self.last, "mean": self.mean, "max": self.max, "count": self.count}
@@ -2,18 +2,44 @@ from __future__ import generator_stop
 from __future__ import annotations
 
 from .WSLayout import WSLayout
+from .WSLod import WSLod
+from .WSModel import WSMapModel, WSObstacle, WSRobotTemplate, WSParticleTemplate
+from .WSMotion import WSInterpolator, WSJitterBuffer
 from .WSParticle import WSParticles
 from .WSRobot import WSRobots
+from .WSStaleness import WSStaleness, WSLatency
 from .WS import WS
-from .scaling import set_scaling_factor, get_scaling_factor, scale
+from .WSSpatialIndex import WSSpatialIndex
+from .WSSprites import WSSpriteAtlas, WSSpriteBatch
+from .scaling import set_scaling_factor, get_scaling_factor, scale, to_screen, to_world, get_view_rect, \
+    get_viewport, zoom_at, pan, reset_viewport
 
 __all__ = [
     'set_scaling_factor',
     'get_scaling_factor',
     'scale',
+    'to_screen',
+    'to_world',
+    'get_view_rect',
+    'get_viewport',
+    'zoom_at',
+    'pan',
+    'reset_viewport',
+    'WSSpatialIndex',
+    'WSSpriteAtlas',
+    'WSSpriteBatch',
     'WSLayout',
+    'WSLod',
+    'WSMapModel',
+    'WSObstacle',
+    'WSRobotTemplate',
+    'WSParticleTemplate',
+    'WSInterpolator',
+    'WSJitterBuffer',
     'WSParticles',
     'WSRobots',
+    'WSStaleness',
+    'WSLatency',
     'WS'
 ]
 
@@ -3,36 +3,116 @@ import sys
 import traceback
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('/tmp/virtualwsgui.log')
-handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(levelname)-8s-[%(filename)s:%(lineno)d]-%(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 scaling_factor = 1
 
+# interactive viewport: zoom on top of the scaling factor and pan offset in screen pixels
+zoom = 1.0
+offset = [0.0, 0.0]
+min_zoom = 0.1
+max_zoom = 20.0
+
 
 def set_scaling_factor(config):
-    global scaling_factor
+    global scaling_factor, min_zoom, max_zoom
     scaling_factor = config["attributes"]["scaling"]
+    viewport = config["attributes"].get("viewport", {})
+    min_zoom = viewport.get("min_zoom", 0.1)
+    max_zoom = viewport.get("max_zoom", 20.0)
+    reset_viewport()
 
 def get_scaling_factor():
     global scaling_factor
     return scaling_factor
 
+
+def reset_viewport():
+    """
+    Reset zoom and pan of the viewport
+    :return: None
+    """
+    global zoom, offset
+    zoom = 1.0
+    offset = [0.0, 0.0]
+
+
+def get_viewport():
+    """
+    Current viewport
+    :return: zoom and pan offset in screen pixels
+    """
+    return zoom, (offset[0], offset[1])
+
+
+def zoom_at(factor, pivot):
+    """
+    Zoom the viewport keeping the world point under the pivot fixed on screen
+    :param factor: zoom factor relative to the current zoom
+    :param pivot: screen coordinates of the pivot
+    :return: None
+    """
+    global zoom
+    new_zoom = min(max(zoom * factor, min_zoom), max_zoom)
+    world = to_world(pivot)
+    zoom = new_zoom
+    offset[0] = world[0] * scaling_factor * zoom - pivot[0]
+    offset[1] = world[1] * scaling_factor * zoom - pivot[1]
+
+
+def pan(dx, dy):
+    """
+    Pan the viewport
+    :param dx: horizontal displacement in screen pixels
+    :param dy: vertical displacement in screen pixels
+    :return: None
+    """
+    offset[0] += dx
+    offset[1] += dy
+
+
+def to_screen(point):
+    """
+    World coordinates to screen coordinates
+    :param point: world coordinates
+    :return: screen coordinates
+    """
+    factor = scaling_factor * zoom
+    return [point[0] * factor - offset[0], point[1] * factor - offset[1]]
+
+
+def to_world(position):
+    """
+    Screen coordinates to world coordinates
+    :param position: screen coordinates
+    :return: world coordinates
+    """
+    factor = scaling_factor * zoom
+    return [(position[0] + offset[0]) / factor, (position[1] + offset[1]) / factor]
+
+
+def get_view_rect(screen_size):
+    """
+    Visible part of the world
+    :param screen_size: screen size in pixels
+    :return: world bounding box (x_min, y_min, x_max, y_max)
+    """
+    top_left = to_world((0, 0))
+    bottom_right = to_world(screen_size)
+    return top_left[0], top_left[1], bottom_right[0], bottom_right[1]
+
 def scale(value):
     """
-    Coordinate scaling
+    Length scaling (scaling factor and viewport zoom). Use to_screen for positions.
     :param value: coordinate value
     :return: scaled coordinates
     """
     global scaling_factor
     try:
+        factor = scaling_factor * zoom
         if (type(value) is int) or (type(value) is float):
-            return value * scaling_factor
+            return value * factor
         elif type(value) is list:
-            return [v * scaling_factor for v in value]
+            return [v * factor for v in value]
         else:
             raise AssertionError(f"Type {type(value)} is not scalable")
     except AssertionError as e:
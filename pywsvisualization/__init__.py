@@ -1,8 +1,14 @@
 from __future__ import generator_stop
 from __future__ import annotations
-from pywsvisualization.pub_sub.AMQPubSub import PubSubAMQP
-from pywsvisualization.WSGui.WS import WS
-from .cli import app_main
+import importlib
+
+# exported names and their modules, imported on first access (pygame and aio_pika are slow to import)
+_exports = {
+    'PubSubAMQP': 'pywsvisualization.pub_sub.AMQPubSub',
+    'WS': 'pywsvisualization.WSGui.WS',
+    'app_main': 'pywsvisualization.cli'
+}
+
 __all__ = [
     'PubSubAMQP',
     'WS',
@@ -10,3 +16,15 @@ __all__ = [
 ]
 
 __version__ = '0.0.1'
+
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
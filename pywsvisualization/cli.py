@@ -7,33 +7,28 @@ import os
 import sys
 import traceback
 import pygame as pg
-import yaml
-from pywsvisualization.WSGui import WS, set_scaling_factor
+from pywsvisualization.WSGui import WS, set_scaling_factor, zoom_at, pan, reset_viewport
+from pywsvisualization.log import setup_logging, stop_logging
+from pywsvisualization.config import load_config
 
 
-logging.basicConfig(level=logging.WARNING, format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s')
-
 # logger for this file
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('/tmp/virtualwsgui.log')
-handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(levelname)-8s-[%(filename)s:%(lineno)d]-%(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
-# TURN OFF asyncio logger
-asyncio_logger = logging.getLogger('asyncio')
-asyncio_logger.setLevel(logging.WARNING)
 
 is_sighup_received = False
 maps = []
 
+# viewport keyboard steps
+ZOOM_STEP = 1.25
+PAN_STEP = 50
+
 
 def parse_arguments():
     """Arguments to run the script"""
     parser = argparse.ArgumentParser(description='Walk Generator')
     parser.add_argument('--config', '-c', required=True, help='YAML Configuration File for Walk Generator with path')
+    parser.add_argument('--supervisor', '-s', action='store_true',
+                        help='Run maps in supervised worker processes')
     return parser.parse_args()
 
 
@@ -50,40 +45,108 @@ def gui_event_handler():
     for event in pg.event.get():
         if event.type == pg.QUIT:
             sys.exit()
+        elif event.type == pg.MOUSEWHEEL:
+            zoom_at(factor=ZOOM_STEP ** event.y, pivot=pg.mouse.get_pos())
+        elif event.type == pg.MOUSEMOTION and (event.buttons[1] or event.buttons[2]):
+            # drag with middle or right mouse button
+            pan(dx=-event.rel[0], dy=-event.rel[1])
+        elif event.type == pg.KEYDOWN:
+            center = [size / 2 for size in pg.display.get_surface().get_size()]
+            if event.key in (pg.K_PLUS, pg.K_EQUALS, pg.K_KP_PLUS):
+                zoom_at(factor=ZOOM_STEP, pivot=center)
+            elif event.key in (pg.K_MINUS, pg.K_KP_MINUS):
+                zoom_at(factor=1 / ZOOM_STEP, pivot=center)
+            elif event.key == pg.K_LEFT:
+                pan(dx=-PAN_STEP, dy=0)
+            elif event.key == pg.K_RIGHT:
+                pan(dx=PAN_STEP, dy=0)
+            elif event.key == pg.K_UP:
+                pan(dx=0, dy=-PAN_STEP)
+            elif event.key == pg.K_DOWN:
+                pan(dx=0, dy=PAN_STEP)
+            elif event.key in (pg.K_0, pg.K_HOME):
+                reset_viewport()
+
+
+async def open_maps(eventloop, scene_config, map_ids=None, headless=False, clock=None):
+    """
+    Create the workspaces of a scene configuration and connect them
+    :param eventloop: event loop for publisher and subscriber
+    :param scene_config: `scene` section of the configuration
+    :param map_ids: ids of the maps to open (default: all maps)
+    :param headless: render off-screen without a window
+    :param clock: clock of the workspaces (default: time module)
+    :return: list of WS
+    """
+    pg.init()
+    workspaces = []
+    for mape in scene_config["maps"]:
+        if map_ids is None or mape["id"] in map_ids:
+            workspaces.append(WS(workspace=mape, eventloop=eventloop, attributes=scene_config["attributes"],
+                                 headless=headless, clock=clock))
+    for workspace in workspaces:
+        await workspace.connect()
+    return workspaces
+
+
+async def close_maps(workspaces):
+    """
+    Close the connections of workspaces before they are dropped on a reload
+    :param workspaces: list of WS
+    :return: None
+    """
+    for workspace in workspaces:
+        await workspace.terminate()
 
 
-async def app(eventloop, config):
+async def app(eventloop, config, map_ids=None, headless=False, frame_callback=None, streaming=True):
     """
     Main Application
     :param eventloop: event loop for publisher and subscriber
+    :param config: configuration file path
+    :param map_ids: ids of the maps to run (default: all maps)
+    :param headless: render off-screen without a window
+    :param frame_callback: called with each workspace after it is drawn (optional)
+    :param streaming: start the frame streaming server if it is enabled in the configuration
     :return: None
     """
     try:
         global is_sighup_received
         global maps
+        frame_server = None
 
         while True:
             scene_config = read_config(yaml_file=config, rootkey="scene")
+            setup_logging(config=scene_config.get("logging"))
             set_scaling_factor(config=scene_config)
             loop_interval = scene_config["attributes"]["interval"]
-            pg.init()
-            maps = []
-            for mape in scene_config["maps"]:
-                maps.append(WS(workspace=mape, eventloop=eventloop))
-
-            for workspace in maps:
-                await workspace.connect()
+            streaming_config = scene_config.get("streaming")
+            if streaming and frame_server is None and streaming_config is not None and \
+                    streaming_config.get("enable", False):
+                from pywsvisualization.stream import FrameServer
+                frame_server = FrameServer(eventloop=eventloop, config=streaming_config)
+                await frame_server.start()
+            maps = await open_maps(eventloop=eventloop, scene_config=scene_config, map_ids=map_ids,
+                                   headless=headless)
 
             # continuously monitor signal handle and update walker
             while not is_sighup_received:
-                gui_event_handler()
+                if not headless:
+                    gui_event_handler()
                 for workspace in maps:
                     workspace.draw()
-                pg.display.update()
+                    if frame_server is not None:
+                        frame_server.submit(map_id=workspace.id, surface=workspace.screen)
+                        frame_server.submit_state(workspace=workspace)
+                    if frame_callback is not None:
+                        frame_callback(workspace)
+                if not headless:
+                    pg.display.update()
                 await asyncio.sleep(loop_interval)
 
-            # If SIGHUP Occurs, Delete the instances
-            del maps
+            # If SIGHUP Occurs, close the connections and delete the instances
+            await close_maps(maps)
+            maps = []
 
             # reset sighup handler flag
             is_sighup_received = False
@@ -100,15 +163,40 @@ async def app(eventloop, config):
         sys.exit()
 
 
+async def supervise(eventloop, config):
+    """
+    Supervisor mode: run the maps in worker processes and composite their frames
+    :param eventloop: event loop
+    :param config: configuration file path
+    :return: None
+    """
+    global is_sighup_received
+    from pywsvisualization.supervisor import Supervisor
+    frame_server = None
+    while True:
+        scene_config = read_config(yaml_file=config, rootkey="scene")
+        setup_logging(config=scene_config.get("logging"))
+        streaming_config = scene_config.get("streaming")
+        if frame_server is None and streaming_config is not None and streaming_config.get("enable", False):
+            from pywsvisualization.stream import FrameServer
+            frame_server = FrameServer(eventloop=eventloop, config=streaming_config)
+            await frame_server.start()
+        supervisor = Supervisor(eventloop=eventloop, config_file=config, scene_config=scene_config)
+        await supervisor.run(frame_server=frame_server, stop=lambda: is_sighup_received)
+        if not is_sighup_received:
+            # window closed
+            return
+        # workers are restarted with the reloaded configuration
+        is_sighup_received = False
+
+
 def read_config(yaml_file, rootkey):
     """Parse the given Configuration File"""
     if os.path.exists(yaml_file):
-        with open(yaml_file, 'r') as config_file:
-            yaml_as_dict = yaml.load(config_file, Loader=yaml.FullLoader)
-        return yaml_as_dict[rootkey]
+        return load_config(yaml_file)[rootkey]
     else:
-        raise FileNotFoundError
         logger.error('YAML Configuration File not Found.')
+        raise FileNotFoundError
 
 
 def app_main():
@@ -120,4 +208,11 @@ def app_main():
 
     event_loop = asyncio.get_event_loop()
     event_loop.add_signal_handler(signal.SIGHUP, functools.partial(signal_handler, name='SIGHUP'))
-    event_loop.run_until_complete(app(event_loop, args.config))
+    supervisor_config = read_config(yaml_file=args.config, rootkey="scene").get("supervisor")
+    try:
+        if args.supervisor or (supervisor_config is not None and supervisor_config.get("enable", False)):
+            event_loop.run_until_complete(supervise(event_loop, args.config))
+        else:
+            event_loop.run_until_complete(app(event_loop, args.config))
+    finally:
+        stop_logging()
@@ -0,0 +1,186 @@
+"""
+Configuration loading for Workspace Visualization
+
+The YAML configuration is parsed with the C loader of PyYAML when it is available,
+validated and stored as a pickled snapshot in a cache directory keyed by the SHA-256
+of the file contents. Unchanged configurations (restarts, SIGHUP reloads, worker
+processes) are loaded from the snapshot instead of being parsed again.
+The cache directory is `$WSVIS_CONFIG_CACHE` (default: ~/.cache/pywsvisualization);
+an empty value disables the on-disk cache. Snapshots are only used if the directory
+and the snapshot are owned by the current user and not writable by others, since
+unpickling a planted file would run arbitrary code.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import yaml
+from pywsvisualization.import_formats import import_format
+
+try:
+    from yaml import CSafeLoader as ConfigLoader
+except ImportError:
+    from yaml import SafeLoader as ConfigLoader
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+# bump when the validation changes, so that older snapshots are not used
+SNAPSHOT_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pywsvisualization")
+
+# snapshots loaded in this process, by file hash
+_snapshots = {}
+
+
+def cache_dir():
+    """
+    Directory of the config snapshots
+    :return: directory path, or None if the cache is disabled
+    """
+    directory = os.environ.get("WSVIS_CONFIG_CACHE", DEFAULT_CACHE_DIR)
+    return directory or None
+
+
+def _require(condition, message):
+    if not condition:
+        raise ValueError(f'Invalid configuration: {message}')
+
+
+def validate_scene(scene):
+    """
+    Check the parts of the scene configuration every workspace relies on
+    :param scene: `scene` section of configuration
+    :return: None, raises ValueError on invalid configuration
+    """
+    _require(isinstance(scene, dict), "scene must be a mapping")
+    attributes = scene.get("attributes")
+    _require(isinstance(attributes, dict), "scene.attributes missing")
+    _require(isinstance(attributes.get("scaling"), (int, float)) and attributes["scaling"] > 0,
+             "scene.attributes.scaling must be a positive number")
+    _require(isinstance(attributes.get("interval"), (int, float)) and attributes["interval"] >= 0,
+             "scene.attributes.interval must be a non-negative number")
+    maps = scene.get("maps")
+    _require(isinstance(maps, list) and len(maps) > 0, "scene.maps must be a non-empty list")
+    map_ids = set()
+    for index, mape in enumerate(maps):
+        where = f'scene.maps[{index}]'
+        _require(isinstance(mape, dict) and "id" in mape, f'{where}.id missing')
+        _require(mape["id"] not in map_ids, f'{where}.id {mape["id"]} is not unique')
+        map_ids.add(mape["id"])
+        dimensions = mape.get("render", {}).get("dimensions")
+        _require(isinstance(dimensions, list) and len(dimensions) == 2 and
+                 all(isinstance(value, (int, float)) and value > 0 for value in dimensions),
+                 f'{where}.render.dimensions must be two positive numbers')
+        imports = mape.get("obstacle_imports")
+        _require(imports is None or isinstance(imports, list), f'{where}.obstacle_imports must be a list')
+        for entry in imports or []:
+            _require(isinstance(entry, dict) and isinstance(entry.get("file"), str),
+                     f'{where}.obstacle_imports entries need a file')
+            _require(import_format(entry) is not None,
+                     f'{where}.obstacle_imports format of {entry["file"]} must be grid, svg or dxf')
+        for section in ("obstacles", "robots", "particles"):
+            entries = mape.get(section)
+            # a map may take all of its obstacles from floor plan imports
+            optional = section == "obstacles" and imports
+            _require(isinstance(entries, list) or (optional and entries is None),
+                     f'{where}.{section} must be a list')
+            for entry in entries or []:
+                _require(isinstance(entry, dict) and "id" in entry and "render" in entry,
+                         f'{where}.{section} entries need id and render')
+        _require(isinstance(mape.get("protocol"), dict), f'{where}.protocol missing')
+
+
+def _parse(data):
+    config = yaml.load(data, Loader=ConfigLoader)
+    _require(isinstance(config, dict), "top level must be a mapping")
+    if "scene" in config:
+        validate_scene(config["scene"])
+    return config
+
+
+def _snapshot_path(digest):
+    directory = cache_dir()
+    if directory is None:
+        return None
+    return os.path.join(directory, f'{digest}.v{SNAPSHOT_VERSION}.pickle')
+
+
+def _trusted(path):
+    """
+    Check that a cache directory or snapshot is owned by the current user and not writable by others
+    :param path: file or directory path
+    :return: True if trusted, raises FileNotFoundError if the path does not exist
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    status = os.lstat(path)
+    return status.st_uid == os.getuid() and not status.st_mode & 0o022
+
+
+def _load_snapshot(path):
+    try:
+        if not _trusted(os.path.dirname(path)) or not _trusted(path):
+            logger.warning('Ignoring config snapshot %s: cache directory or snapshot is writable by other users',
+                           path)
+            return None
+        with open(path, 'rb') as snapshot:
+            return pickle.load(snapshot)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning('Ignoring unreadable config snapshot %s: %s', path, e)
+        return None
+
+
+def _store_snapshot(path, config):
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        if not _trusted(os.path.dirname(path)):
+            logger.warning('Not storing config snapshot: cache directory %s is writable by other users',
+                           os.path.dirname(path))
+            return
+        # write and rename, so that concurrent readers never see a partial snapshot
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as snapshot:
+            pickle.dump(config, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning('Could not store config snapshot %s: %s', path, e)
+
+
+def load_config(yaml_file):
+    """
+    Load and validate the configuration file, using the cached snapshot if the file is unchanged
+    :param yaml_file: configuration file path
+    :return: configuration dictionary (shared, do not modify)
+    """
+    with open(yaml_file, 'rb') as config_file:
+        data = config_file.read()
+    digest = hashlib.sha256(data).hexdigest()
+    config = _snapshots.get(digest)
+    if config is not None:
+        return config
+    path = _snapshot_path(digest)
+    if path is not None:
+        config = _load_snapshot(path)
+    if config is None:
+        config = _parse(data)
+        if path is not None:
+            _store_snapshot(path, config)
+    _snapshots.clear()
+    _snapshots[digest] = config
+    return config
+
+
+def read_config(yaml_file, rootkey):
+    """
+    Section of the configuration file
+    :param yaml_file: configuration file path
+    :param rootkey: top level key
+    :return: configuration dictionary of the section
+    """
+    return load_config(yaml_file)[rootkey]
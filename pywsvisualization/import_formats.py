@@ -0,0 +1,31 @@
+"""
+Floor plan formats of obstacle imports
+
+Kept free of pygame and numpy so that configuration validation can check import
+entries without loading the importer.
+"""
+
+import os
+
+FORMATS = {
+    ".svg": "svg",
+    ".dxf": "dxf",
+    ".png": "grid",
+    ".pgm": "grid",
+    ".pbm": "grid",
+    ".bmp": "grid",
+    ".gif": "grid",
+    ".jpg": "grid",
+    ".jpeg": "grid",
+    ".tga": "grid"
+}
+
+
+def import_format(config):
+    """
+    Source format of a floor plan import, given explicitly or derived from the file extension
+    :param config: import configuration (file, format, ...)
+    :return: "grid", "svg", "dxf" or None if unknown
+    """
+    source_format = config.get("format") or FORMATS.get(os.path.splitext(config["file"])[1].lower())
+    return source_format if source_format in ("grid", "svg", "dxf") else None
@@ -0,0 +1,160 @@
+"""
+Logging for Workspace Visualization
+
+Modules only create their logger with `logging.getLogger(__name__)` and log with
+%-style arguments. `setup_logging` installs a single queue handler on the root
+logger; records are formatted and written to the log file and the console by a
+listener thread, off the render and telemetry path. Levels per logger come from
+the `logging` section of the scene configuration and high-rate records (debug by
+default) are rate limited per call site. Pending records are flushed at interpreter
+exit, so messages logged right before `sys.exit()` are not lost.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+LOG_FORMAT = '%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
+
+DEFAULT_CONFIG = {
+    "level": "WARNING",
+    "file": "/tmp/virtualwsgui.log",
+    "file_level": "ERROR",
+    "console_level": "WARNING",
+    "levels": {
+        "aio_pika": "ERROR",
+        "asyncio": "WARNING"
+    },
+    "rate_limit": {
+        "max_level": "DEBUG",
+        "period": 1.0,
+        "burst": 10
+    }
+}
+
+_listener = None
+_queue_handler = None
+_configured_levels = set()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Pass at most `burst` records per call site every `period` seconds for records up to
+    `max_level`. The number of dropped records is appended to the next record that passes.
+    """
+    def __init__(self, max_level=logging.DEBUG, period=1.0, burst=10):
+        """
+        Initialization of rate limit filter
+        :param max_level: highest level that is rate limited
+        :param period: window length in seconds
+        :param burst: records passed per call site and window
+        """
+        super().__init__()
+        self.max_level = max_level
+        self.period = period
+        self.burst = burst
+        self.sites = {}
+
+    def filter(self, record):
+        if record.levelno > self.max_level or self.burst <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        window_start, count, suppressed = self.sites.get(key, (now, 0, 0))
+        if now - window_start >= self.period:
+            window_start, count = now, 0
+        if count >= self.burst:
+            self.sites[key] = (window_start, count, suppressed + 1)
+            return False
+        self.sites[key] = (window_start, count + 1, 0)
+        if suppressed:
+            if not record.args:
+                record.msg = str(record.msg).replace('%', '%%')
+                record.args = ()
+            if isinstance(record.args, tuple):
+                record.msg = f'{record.msg} (%d similar messages suppressed)'
+                record.args = record.args + (suppressed,)
+        return True
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread. Records stay within
+    the process, so message arguments need not be rendered before enqueueing.
+    """
+    def prepare(self, record):
+        return record
+
+
+def _level(value):
+    if isinstance(value, int):
+        return value
+    return logging.getLevelName(str(value).upper())
+
+
+def setup_logging(config=None):
+    """
+    Install the queued logging of this process, or apply new levels if it is already installed
+    :param config: `logging` section of scene configuration (optional)
+    :return: None
+    """
+    global _listener, _queue_handler
+    if config is None:
+        config = {}
+    rate_limit = dict(DEFAULT_CONFIG["rate_limit"], **config.get("rate_limit", {}))
+    levels = dict(DEFAULT_CONFIG["levels"], **config.get("levels", {}))
+
+    root = logging.getLogger()
+    root.setLevel(_level(config.get("level", DEFAULT_CONFIG["level"])))
+    # loggers configured before but no longer listed fall back to the root level
+    for name in _configured_levels - set(levels):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(_level(level))
+    _configured_levels.clear()
+    _configured_levels.update(levels)
+
+    if _queue_handler is None:
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        file_name = config.get("file", DEFAULT_CONFIG["file"])
+        if file_name:
+            file_handler = logging.FileHandler(file_name)
+            file_handler.setLevel(_level(config.get("file_level", DEFAULT_CONFIG["file_level"])))
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(_level(config.get("console_level", DEFAULT_CONFIG["console_level"])))
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+        _queue_handler = _LazyQueueHandler(queue.SimpleQueue())
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # stop_logging does nothing if it was already called
+        atexit.register(stop_logging)
+    _queue_handler.filters = [RateLimitFilter(max_level=_level(rate_limit["max_level"]),
+                                              period=rate_limit["period"],
+                                              burst=rate_limit["burst"])]
+
+
+def stop_logging():
+    """
+    Flush pending records and stop the listener thread
+    :return: None
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
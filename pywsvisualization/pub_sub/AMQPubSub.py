@@ -9,18 +9,19 @@ ChangeLog:
     - update: initial version of wrapper class
     - update: Apply linting
     - update: Refactor Class with documentation
+    - update: topic bindings on the configured exchange with exclusive queues
+    - update: buffered, batched publishing with publisher confirms and bounded retry
 """
 
+import asyncio
+import collections
 import sys
 import logging
 from aio_pika import connect_robust, Message, DeliveryMode, ExchangeType, IncomingMessage
 from aio_pika import exceptions as aio_pika_exception
 
 # logger for this file
-logger = logging.getLogger("PubSub:AMQP")
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format='%(levelname)-2s [%(filename)s:%(lineno)d] %(message)s')
-aio_pika_logger = logging.getLogger('aio_pika')
-aio_pika_logger.setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
 
 
 class PubSubAMQP:
@@ -36,14 +37,47 @@ class PubSubAMQP:
             self.broker_info = config_file["broker"]
             self.credential_info = config_file["credential"]
             self.exchange_name = config_file["exchange"]
+            # exchange declaration, passive only checks that the exchange exists
+            self.exchange_type = config_file.get("exchange_type", "topic")
+            self.exchange_durable = config_file.get("exchange_durable", True)
+            self.exchange_passive = config_file.get("exchange_passive", False)
             self.queue_name = config_file["queue"]
-            self.cb_handler = config_file["handler"]
+            self.cb_handler = config_file.get("handler")
+            # routing key templates for topic bindings (None: consume the durable queue as is)
+            self.binding_templates = config_file.get("bindings")
+            self.exclusive = config_file.get("exclusive", True)
+            self.region_size = config_file.get("region_size", 50)
+            # more visible region tiles than this are bound with a single region wildcard
+            self.max_regions = config_file.get("max_regions", 16)
+            self.entities = config_file.get("entities")
             self.binding_suffix = binding_suffix
             self.eventloop = eventloop
             self.connection = None
             self.channel = None
             self.exchange = None
+            self.queue = None
+            self.bindings = set()
+            self.pending_bindings = set()
+            self.binding_lock = asyncio.Lock()
             self.app_callback = app_callback
+            # outbound buffer, drained in batches by the publisher task
+            self.delivery_mode = DeliveryMode.PERSISTENT if config_file.get("delivery", "persistent") == "persistent" \
+                else DeliveryMode.NOT_PERSISTENT
+            self.batch_size = config_file.get("batch_size", 100)
+            self.max_buffer = config_file.get("max_buffer", 10000)
+            self.max_retries = config_file.get("max_retries", 5)
+            self.retry_backoff = config_file.get("retry_backoff", 0.5)
+            self.confirm_timeout = config_file.get("confirm_timeout", 5.0)
+            # derived events this publisher sends (used by the workspace)
+            self.config_events = config_file.get("events", [])
+            self.metrics_interval = config_file.get("metrics_interval", 1.0)
+            self.outbound = collections.deque()
+            self.outbound_ready = asyncio.Event()
+            self.outbound_space = asyncio.Event()
+            self.outbound_space.set()
+            self.publisher_task = None
+            self.in_flight = 0
+            self.publish_stats = {"published": 0, "retried": 0, "failed": 0, "rejected": 0}
 
             logger.debug('RabbitMQ Exchange: %s', self.exchange_name)
             logger.debug('Binding Suffix: %s', self.binding_suffix)
@@ -68,19 +102,37 @@ class PubSubAMQP:
                     "connection_name": "visual"}
                 }
             )
-            self.channel = await self.connection.channel()
+            self.channel = await self.connection.channel(publisher_confirms=True)
             if mode == "subscriber":
                 await self._sub_connect()
+            else:
+                self.exchange = await self._declare_exchange()
+                self.publisher_task = self.eventloop.create_task(self._publisher())
         except aio_pika_exception.AMQPException as e:
             logger.error('Exception while Connecting to Broker')
             logger.error(e)
             sys.exit(-1)
 
+    async def _declare_exchange(self):
+        """_declare_exchange: private method to declare the configured exchange, or look it up if passive"""
+        return await self.channel.declare_exchange(self.exchange_name, ExchangeType(self.exchange_type),
+                                                   durable=self.exchange_durable, passive=self.exchange_passive)
+
     async def _sub_connect(self):
         """_sub_connect: private method for subscribing data to Broker. Setup dedicated channel, exchange"""
         try:
             await self.channel.set_qos(prefetch_count=1)
-            queue = await self.channel.declare_queue(self.queue_name, durable=True)
+            if self.binding_templates is None:
+                queue = await self.channel.declare_queue(self.queue_name, durable=True)
+            else:
+                self.exchange = await self._declare_exchange()
+                if self.exclusive:
+                    # server named queue that lives as long as this instance is connected
+                    queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+                else:
+                    queue = await self.channel.declare_queue(self.queue_name, durable=True)
+                self.queue = queue
+                await self.update_bindings(self.pending_bindings)
             await queue.consume(self._sub_on_message)
         except Exception as e:
             logger.error('_sub_connect: Exception during setup of sub channel, exchange')
@@ -92,39 +144,131 @@ class PubSubAMQP:
         """_sub_on_message: private method to handle consumption of message during subscription"""
 
         async with message.process():
-            logger.debug(f"msg received: Exchange {message.exchange}, Routing {message.routing_key}")
+            logger.debug('msg received: Exchange %s, Routing %s', message.exchange, message.routing_key)
             if self.app_callback is not None:
                 await self.app_callback(
                     exchange_name=message.exchange,
                     binding_name=message.routing_key,
-                    message_body=message.body
+                    message_body=message.body,
+                    handler_name=self.cb_handler
                 )
 
-    async def publish(self, message_content, priority=0):
-        """publish: Produce Message to Message Broker
+    async def update_bindings(self, routing_keys):
+        """update_bindings: bind the subscription queue to exactly the given routing keys on the exchange
+        - routing_keys: set of routing keys (topic patterns)
+        """
+        routing_keys = set(routing_keys)
+        if self.queue is None:
+            # not connected yet, bind on connect
+            self.pending_bindings = routing_keys
+            return
+        async with self.binding_lock:
+            try:
+                for routing_key in routing_keys - self.bindings:
+                    await self.queue.bind(self.exchange, routing_key=routing_key)
+                    self.bindings.add(routing_key)
+                for routing_key in self.bindings - routing_keys:
+                    await self.queue.unbind(self.exchange, routing_key=routing_key)
+                    self.bindings.discard(routing_key)
+                logger.debug('Bindings on %s: %s', self.exchange_name, sorted(self.bindings))
+            except aio_pika_exception.AMQPException as e:
+                logger.error('update_bindings: Exception while updating bindings')
+                logger.error(e)
+
+    def publish_nowait(self, message_content, routing_key=None, priority=0):
+        """publish_nowait: queue a message for publishing without waiting (for the render loop)
         - message_content: payload of message to be published
+        - routing_key: routing key on the exchange (default: queue name on the default exchange)
         - priority: message priority
+        - returns False if the outbound buffer is full and the message was rejected
         """
+        if len(self.outbound) >= self.max_buffer:
+            self.publish_stats["rejected"] += 1
+            self.outbound_space.clear()
+            return False
+        self.outbound.append((message_content, routing_key, priority, 0))
+        self.outbound_ready.set()
+        return True
+
+    async def publish(self, message_content, priority=0, routing_key=None):
+        """publish: queue a message for publishing, waiting while the outbound buffer is full
+        - message_content: payload of message to be published
+        - priority: message priority
+        - routing_key: routing key on the exchange (default: queue name on the default exchange)
+        """
+        while len(self.outbound) >= self.max_buffer:
+            self.outbound_space.clear()
+            await self.outbound_space.wait()
+        self.outbound.append((message_content, routing_key, priority, 0))
+        self.outbound_ready.set()
+
+    async def _publish_one(self, message_content, routing_key, priority):
+        message = Message(
+            body=message_content,
+            delivery_mode=self.delivery_mode,
+            priority=priority
+        )
+        if routing_key is None:
+            exchange, routing_key = self.channel.default_exchange, self.queue_name
+        else:
+            exchange = self.exchange
+        # with publisher confirms the publish returns when the broker acknowledged the message
+        await exchange.publish(message, routing_key=routing_key, timeout=self.confirm_timeout)
+
+    async def _publisher(self):
+        """_publisher: private task sending the outbound buffer in batches and retrying failed messages"""
         try:
-            message = Message(
-                body=message_content,
-                delivery_mode=DeliveryMode.PERSISTENT,
-                priority=priority
-            )
-            await self.channel.default_exchange.publish(message, routing_key=self.queue_name)
-        except aio_pika_exception.AMQPException as e:
-            logger.error(e)
-            await self.terminate()
-            sys.exit(-1)
-        except Exception as e:
-            logger.error('Exception during Publishing Message to Broker')
-            logger.error(e)
-            await self.terminate()
-            sys.exit(-1)
+            while True:
+                await self.outbound_ready.wait()
+                if not self.outbound:
+                    self.outbound_ready.clear()
+                    continue
+                batch = [self.outbound.popleft() for _ in range(min(self.batch_size, len(self.outbound)))]
+                self.in_flight = len(batch)
+                if len(self.outbound) < self.max_buffer:
+                    self.outbound_space.set()
+                results = await asyncio.gather(*[self._publish_one(content, routing_key, priority)
+                                                 for content, routing_key, priority, _ in batch],
+                                               return_exceptions=True)
+                self.in_flight = 0
+                failed = []
+                for entry, result in zip(batch, results):
+                    if not isinstance(result, Exception):
+                        self.publish_stats["published"] += 1
+                    elif entry[3] < self.max_retries:
+                        failed.append((entry[0], entry[1], entry[2], entry[3] + 1))
+                    else:
+                        self.publish_stats["failed"] += 1
+                        logger.error('Dropping message after %d attempts: %s', entry[3] + 1, result)
+                if failed:
+                    self.publish_stats["retried"] += len(failed)
+                    logger.warning('Publishing %d messages failed, retrying: %s', len(failed),
+                                   next(result for result in results if isinstance(result, Exception)))
+                    # failed messages go back to the front in their original order
+                    self.outbound.extendleft(reversed(failed))
+                    await asyncio.sleep(self.retry_backoff * 2 ** (failed[0][3] - 1))
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self, timeout=None):
+        """flush: wait until the outbound buffer is sent
+        - timeout: seconds to wait at most (default: no limit)
+        """
+        async def drained():
+            while self.outbound or self.in_flight:
+                await asyncio.sleep(0.01)
+        try:
+            await asyncio.wait_for(drained(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning('%d messages not published on %s', len(self.outbound) + self.in_flight,
+                           self.exchange_name)
 
     async def terminate(self):
         """terminate: close the connection to the broker"""
+        if self.publisher_task is not None:
+            self.publisher_task.cancel()
+            self.publisher_task = None
         await self.connection.close()
 
     def get_callback_handler_name(self):
-        return self.cb_handler
\ No newline at end of file
+        return self.cb_handler
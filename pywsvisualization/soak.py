@@ -0,0 +1,509 @@
+"""
+Soak Harness for Workspace Visualization
+
+Drives the workspaces of a configuration with synthetic robot and personnel telemetry
+in accelerated time: frames are drawn back to back and every frame advances a simulated
+clock by the soak time step, independent of the render loop interval. The workspaces
+run on the simulated clock, so telemetry timestamps, the jitter buffer, interpolation
+and staleness all see simulated time. A SIGHUP reload (close and reopen all maps, as
+`cli.app` does) is simulated periodically. Resident memory, traced allocations, live
+pygame surfaces and fonts, workspaces still alive after reloads, open file descriptors,
+broker connections and asyncio tasks are sampled along the way; the run fails if their
+growth after warm-up exceeds the budget of the `soak` section of the scene configuration.
+Resident memory grows over the first reloads until the allocator has warmed up, the
+baseline is therefore taken after a warm-up period.
+
+    ws-soak -c config.yaml --duration 86400 --report soak.json
+
+With allocation tracing a simulated day takes several hours of wall time, `--no-trace`
+runs about four times faster.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import math
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+import pygame as pg
+from pywsvisualization.WSGui import WS, set_scaling_factor
+from pywsvisualization.log import setup_logging, stop_logging
+from pywsvisualization.cli import read_config, open_maps, close_maps
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "duration": 3600.0,  # simulated seconds
+    "time_step": 0.5,  # simulated seconds per frame
+    "reload_interval": 300.0,  # simulated seconds between SIGHUP reloads
+    "sample_interval": 60.0,  # simulated seconds between resource samples
+    "warmup": 1200.0,  # simulated seconds before the baseline sample
+    "telemetry_rate": 10.0,  # messages per entity and simulated second
+    "max_rays": 32,  # ray cast contact points per personnel message
+    "snapshot_interval": 30.0,  # simulated seconds between snapshot requests (streaming only)
+    "budgets": {  # allowed growth between baseline and final sample
+        "rss_mb": 64.0,
+        "traced_mb": 16.0,
+        "surfaces": 64,
+        "fonts": 0,
+        "workspaces": 0,
+        "fds": 0,
+        "connections": 0,
+        "tasks": 0
+    }
+}
+
+# budget key -> sample key and unit conversion
+BUDGETS = {
+    "rss_mb": ("rss", 1.0 / (1 << 20)),
+    "traced_mb": ("traced", 1.0 / (1 << 20)),
+    "surfaces": ("surfaces", 1),
+    "fonts": ("fonts", 1),
+    "workspaces": ("workspaces", 1),
+    "fds": ("fds", 1),
+    "connections": ("connections", 1),
+    "tasks": ("tasks", 1)
+}
+
+
+def rss_bytes():
+    """
+    Resident set size of this process
+    :return: bytes (peak RSS where the current RSS is not available)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def open_fds():
+    """
+    Open file descriptors (sockets, files, pipes) of this process
+    :return: count or None if not available
+    """
+    for path in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return None
+
+
+def count_live(types):
+    """
+    Count live objects of the given types. Surfaces and fonts are not tracked by the garbage
+    collector, so they are found as referents of tracked objects and of the containers the
+    collector stopped tracking because they only hold untracked objects (e.g. sprite caches).
+    :param types: dictionary of name -> type
+    :return: dictionary of name -> count
+    """
+    seen = {name: set() for name in types}
+    pending = gc.get_objects()
+    visited = set()
+    while pending:
+        container = pending.pop()
+        for obj in gc.get_referents(container):
+            if isinstance(obj, (dict, list, tuple, set, frozenset)):
+                if not gc.is_tracked(obj) and id(obj) not in visited:
+                    visited.add(id(obj))
+                    pending.append(obj)
+                continue
+            for name, cls in types.items():
+                if isinstance(obj, cls):
+                    seen[name].add(id(obj))
+    return {name: len(ids) for name, ids in seen.items()}
+
+
+def broker_connections():
+    """
+    Open broker connections of live publishers and subscribers
+    :return: count
+    """
+    from pywsvisualization.pub_sub import PubSubAMQP
+    return sum(1 for obj in gc.get_objects()
+               if isinstance(obj, PubSubAMQP) and obj.connection is not None and
+               not getattr(obj.connection, "is_closed", False))
+
+
+class SimulatedClock:
+    """
+    Clock of the soak run with the interface of the time module used by the workspaces.
+    Starts at the current time and only advances when the harness steps it.
+    """
+    def __init__(self):
+        self.epoch = time.time()
+        self.origin = time.monotonic()
+        self.elapsed = 0.0
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+
+    def time(self):
+        return self.epoch + self.elapsed
+
+    def monotonic(self):
+        return self.origin + self.elapsed
+
+
+class SyntheticTelemetry:
+    """
+    Robot and personnel messages of a workspace in the format of the telemetry publishers.
+    Robots swing their arm around the base, personnel walk on circles.
+    """
+    def __init__(self, workspace, rate, max_rays, clock, seed=0):
+        """
+        Initialization of synthetic telemetry
+        :param workspace: WS instance
+        :param rate: messages per entity and simulated second
+        :param max_rays: largest number of ray cast contact points per personnel message
+        :param clock: SimulatedClock of the run, messages are timestamped when they are due
+        :param seed: random seed
+        """
+        self.workspace = workspace
+        self.period = 1.0 / rate
+        self.max_rays = max_rays
+        self.clock = clock
+        self.random = random.Random(seed)
+        width, height = workspace.model.dimensions
+        self.robots = [(robot_id, (self.random.uniform(0.2, 0.8) * width, self.random.uniform(0.2, 0.8) * height),
+                        self.random.uniform(0.0, 2 * math.pi))
+                       for robot_id, _ in workspace.model.robots]
+        self.particles = [(particle_id, (width / 2, height / 2), self.random.uniform(0.1, 0.4) * min(width, height),
+                           self.random.uniform(0.0, 2 * math.pi))
+                          for particle_id, _ in workspace.model.particles]
+        self.next_time = 0.0
+        self.sent = 0
+
+    def robot_message(self, robot_id, base, phase, sim_time, timestamp):
+        angle = phase + sim_time
+        shoulder = [base[0] + 5 * math.cos(angle), base[1] + 5 * math.sin(angle)]
+        elbow = [shoulder[0] + 3 * math.cos(2 * angle), shoulder[1] + 3 * math.sin(2 * angle)]
+        wrist = [elbow[0] + 3 * math.cos(3 * angle), elbow[1] + 3 * math.sin(3 * angle)]
+        return {"id": robot_id, "base": list(base), "shoulder": shoulder, "elbow": elbow, "wrist": wrist,
+                "timestamp": timestamp}
+
+    def personnel_message(self, particle_id, center, radius, phase, sim_time, timestamp):
+        angle = phase + sim_time * 0.2
+        x = center[0] + radius * math.cos(angle)
+        y = center[1] + radius * math.sin(angle)
+        rays = [{"angle": ray, "contact_point": [x + 10 * math.cos(ray), y + 10 * math.sin(ray)]}
+                for ray in (2 * math.pi * i / self.max_rays for i in range(self.random.randint(0, self.max_rays)))]
+        return {"id": particle_id, "timestamp": timestamp,
+                "x_ref_pos": x, "y_ref_pos": y, "z_ref_pos": 0,
+                "x_uwb_pos": x + self.random.gauss(0, 0.5), "y_uwb_pos": y + self.random.gauss(0, 0.5), "z_uwb_pos": 0,
+                "x_est_pos": x + self.random.gauss(0, 0.2), "y_est_pos": y + self.random.gauss(0, 0.2), "z_est_pos": 0,
+                "view": rays,
+                "ref_heading": {"start": [x, y], "end": [x - math.sin(angle), y + math.cos(angle)]}}
+
+    async def send(self, sim_time):
+        """
+        Feed all messages due at the simulated time through the telemetry handlers of the workspace
+        :param sim_time: simulated time in seconds
+        :return: number of messages sent
+        """
+        sent = 0
+        while self.next_time <= sim_time:
+            timestamp = self.clock.epoch + self.next_time
+            for robot_id, base, phase in self.robots:
+                await self.workspace.consume_telemetry_msgs(
+                    exchange_name="soak", binding_name="robot", handler_name="robot_msg_handler",
+                    message_body=json.dumps(self.robot_message(robot_id, base, phase, self.next_time, timestamp)))
+                sent += 1
+            for particle_id, center, radius, phase in self.particles:
+                await self.workspace.consume_telemetry_msgs(
+                    exchange_name="soak", binding_name="personnel", handler_name="personnel_msg_handler",
+                    message_body=json.dumps(self.personnel_message(particle_id, center, radius, phase,
+                                                                   self.next_time, timestamp)))
+                sent += 1
+            self.next_time += self.period
+        self.sent += sent
+        return sent
+
+
+class SoakRun:
+    """
+    One soak run: simulated clock, reload cycle, resource samples and budget verdict
+    """
+    def __init__(self, eventloop, config_file, config=None, use_broker=False, streaming=False, trace=True):
+        """
+        Initialization of soak run
+        :param eventloop: event loop
+        :param config_file: configuration file path
+        :param config: `soak` section overrides (optional)
+        :param use_broker: keep the configured publishers and subscribers and connect them
+        :param streaming: run the frame streaming server on an ephemeral local port and request snapshots
+        :param trace: track allocations with tracemalloc
+        """
+        scene_config = read_config(yaml_file=config_file, rootkey="scene")
+        self.config = dict(DEFAULT_CONFIG, **(scene_config.get("soak") or {}))
+        self.config.update(config or {})
+        self.config["budgets"] = dict(DEFAULT_CONFIG["budgets"], **self.config.get("budgets", {}))
+        self.eventloop = eventloop
+        self.config_file = config_file
+        self.use_broker = use_broker
+        self.streaming = streaming
+        self.trace = trace
+        self.frame_server = None
+        self.clock = SimulatedClock()
+        self.maps = []
+        self.telemetry = []
+        self.samples = []
+        self.baseline = None
+        self.baseline_snapshot = None
+        self.frames = 0
+        self.reloads = 0
+        self.messages = 0
+        self.snapshots = 0
+        self.requests = set()
+
+    def scene(self):
+        """
+        Scene configuration as read on a reload. Without a broker the protocol is left out and
+        telemetry only comes from the harness.
+        :return: scene configuration
+        """
+        scene_config = read_config(yaml_file=self.config_file, rootkey="scene")
+        if self.use_broker:
+            return scene_config
+        # the loaded configuration is shared, replace the maps instead of modifying them
+        maps = [dict(mape, protocol={"subscribers": None, "publishers": None}) for mape in scene_config["maps"]]
+        return dict(scene_config, maps=maps)
+
+    async def open(self):
+        scene_config = self.scene()
+        setup_logging(config=scene_config.get("logging"))
+        set_scaling_factor(config=scene_config)
+        self.maps = await open_maps(eventloop=self.eventloop, scene_config=scene_config, headless=True,
+                                    clock=self.clock)
+        self.telemetry = [SyntheticTelemetry(workspace=workspace, rate=self.config["telemetry_rate"],
+                                             max_rays=self.config["max_rays"], clock=self.clock,
+                                             seed=self.reloads)
+                          for workspace in self.maps]
+
+    async def reload(self):
+        await close_maps(self.maps)
+        self.maps = []
+        self.telemetry = []
+        self.reloads += 1
+        await self.open()
+
+    def sample(self, sim_time):
+        """
+        Sample resource usage after a full garbage collection
+        :param sim_time: simulated time in seconds
+        :return: sample dictionary
+        """
+        gc.collect()
+        sample = {"sim_time": sim_time, "wall_time": time.monotonic() - self.start, "frames": self.frames,
+                  "reloads": self.reloads, "rss": rss_bytes(),
+                  "traced": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+                  "fds": open_fds(), "connections": broker_connections(), "tasks": len(asyncio.all_tasks())}
+        sample.update(count_live({"surfaces": pg.Surface, "fonts": pg.font.Font, "workspaces": WS}))
+        self.samples.append(sample)
+        logger.info('Soak sample: %s', sample)
+        return sample
+
+    async def request_snapshot(self):
+        port = self.frame_server.server.sockets[0].getsockname()[1]
+        for workspace in self.maps:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET /snapshot/{workspace.id}?scale=0.5 HTTP/1.1\r\n\r\n".encode())
+            await writer.drain()
+            # the server answers once the render loop submits the next frame
+            task = self.eventloop.create_task(self._read_snapshot(reader, writer))
+            self.requests.add(task)
+            task.add_done_callback(self.requests.discard)
+
+    async def _read_snapshot(self, reader, writer):
+        try:
+            if (await reader.read()).startswith(b"HTTP/1.1 200"):
+                self.snapshots += 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def step(self, sim_time):
+        """
+        Feed due telemetry and draw one frame of every workspace
+        :param sim_time: simulated time in seconds
+        :return: None
+        """
+        for telemetry in self.telemetry:
+            self.messages += await telemetry.send(sim_time)
+        for workspace in self.maps:
+            workspace.draw(now=self.clock.time())
+            if self.frame_server is not None:
+                self.frame_server.submit(map_id=workspace.id, surface=workspace.screen)
+                self.frame_server.submit_state(workspace=workspace)
+        self.frames += 1
+        # let connections, snapshot requests and executor callbacks run
+        await asyncio.sleep(0)
+
+    async def run(self):
+        """
+        Run the soak for the configured simulated duration
+        :return: report dictionary
+        """
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        self.start = time.monotonic()
+        pg.init()
+        if self.streaming:
+            from pywsvisualization.stream import FrameServer
+            streaming_config = read_config(yaml_file=self.config_file, rootkey="scene").get("streaming") or {}
+            self.frame_server = FrameServer(eventloop=self.eventloop,
+                                            config=dict(streaming_config, address="127.0.0.1", port=0))
+            await self.frame_server.start()
+        await self.open()
+        duration = self.config["duration"]
+        sim_time = 0.0
+        next_reload = self.config["reload_interval"]
+        next_sample = 0.0
+        next_snapshot = self.config["snapshot_interval"]
+        try:
+            while sim_time < duration or self.requests:
+                await self.step(sim_time)
+                sim_time += self.config["time_step"]
+                self.clock.advance(self.config["time_step"])
+                if sim_time >= duration:
+                    # drain snapshot requests in flight before the final sample
+                    continue
+                # samples are taken between reloads and without snapshot requests in flight
+                if sim_time >= next_sample and not self.requests:
+                    self.sample(sim_time)
+                    if self.baseline is None and sim_time >= self.config["warmup"]:
+                        self.baseline = self.samples[-1]
+                        if tracemalloc.is_tracing():
+                            self.baseline_snapshot = tracemalloc.take_snapshot()
+                    next_sample += self.config["sample_interval"]
+                if sim_time >= next_reload:
+                    await self.reload()
+                    next_reload += self.config["reload_interval"]
+                if self.frame_server is not None and sim_time >= next_snapshot:
+                    await self.request_snapshot()
+                    next_snapshot += self.config["snapshot_interval"]
+            final = self.sample(sim_time)
+            return self.report(final)
+        finally:
+            for task in list(self.requests):
+                task.cancel()
+            await close_maps(self.maps)
+            self.maps = []
+            if self.frame_server is not None:
+                await self.frame_server.stop()
+            if self.trace:
+                tracemalloc.stop()
+
+    def top_allocations(self, limit=10):
+        """
+        Source lines with the largest allocation growth since the baseline
+        :param limit: number of lines
+        :return: list of dictionaries with file, line, size and count growth
+        """
+        if self.baseline_snapshot is None or not tracemalloc.is_tracing():
+            return []
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib*")]
+        snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+        stats = snapshot.compare_to(self.baseline_snapshot.filter_traces(filters), "lineno")
+        return [{"file": stat.traceback[0].filename, "line": stat.traceback[0].lineno,
+                 "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in stats[:limit]]
+
+    def report(self, final):
+        """
+        Growth between baseline and final sample checked against the budgets
+        :param final: final sample
+        :return: report dictionary
+        """
+        baseline = self.baseline if self.baseline is not None else self.samples[0]
+        growth = {}
+        violations = []
+        for budget, (key, unit) in BUDGETS.items():
+            if baseline.get(key) is None or final.get(key) is None:
+                continue
+            growth[budget] = (final[key] - baseline[key]) * unit
+            limit = self.config["budgets"].get(budget)
+            if limit is not None and growth[budget] > limit:
+                violations.append({"budget": budget, "growth": growth[budget], "limit": limit})
+        return {"config": self.config, "use_broker": self.use_broker, "streaming": self.streaming,
+                "sim_time": final["sim_time"], "wall_time": final["wall_time"], "frames": self.frames,
+                "reloads": self.reloads, "messages": self.messages, "snapshots": self.snapshots,
+                "baseline": baseline, "final": final, "growth": growth, "violations": violations,
+                "top_allocations": self.top_allocations(), "passed": not violations, "samples": self.samples}
+
+
+def format_report(report):
+    """
+    Human readable summary of a soak report
+    :param report: report dictionary
+    :return: text
+    """
+    lines = [f"soak {'PASSED' if report['passed'] else 'FAILED'}: {report['sim_time']:.0f} s simulated in "
+             f"{report['wall_time']:.0f} s, {report['frames']} frames, {report['messages']} messages, "
+             f"{report['reloads']} reloads, {report['snapshots']} snapshots"]
+    violated = {violation["budget"] for violation in report["violations"]}
+    for budget, growth in report["growth"].items():
+        lines.append(f"  {budget:<12} {growth:>12.2f}  (budget {report['config']['budgets'].get(budget)})"
+                     f"{'  EXCEEDED' if budget in violated else ''}")
+    if report["top_allocations"]:
+        lines.append("  allocation growth since baseline:")
+        for stat in report["top_allocations"]:
+            lines.append(f"    {stat['size_diff'] / 1024:>10.1f} KiB {stat['count_diff']:>+8d}  "
+                         f"{stat['file']}:{stat['line']}")
+    return "\n".join(lines)
+
+
+def parse_arguments():
+    """Arguments to run the soak harness"""
+    parser = argparse.ArgumentParser(description='Workspace visualization soak harness')
+    parser.add_argument('--config', '-c', required=True, help='YAML Configuration File with path')
+    parser.add_argument('--duration', type=float, help='simulated seconds to run')
+    parser.add_argument('--time-step', type=float, help='simulated seconds per frame')
+    parser.add_argument('--reload-interval', type=float, help='simulated seconds between reloads')
+    parser.add_argument('--sample-interval', type=float, help='simulated seconds between resource samples')
+    parser.add_argument('--warmup', type=float, help='simulated seconds before the baseline sample')
+    parser.add_argument('--report', '-r', help='write the JSON report to this file')
+    parser.add_argument('--broker', action='store_true', help='connect the configured publishers and subscribers')
+    parser.add_argument('--streaming', action='store_true', help='run the frame server and request snapshots')
+    parser.add_argument('--no-trace', action='store_true', help='do not track allocations with tracemalloc')
+    return parser.parse_args()
+
+
+def soak_main():
+    """Run the soak harness, exit with status 1 if a budget is exceeded"""
+    args = parse_arguments()
+    if not os.path.isfile(args.config):
+        logger.error("configuration file not readable. Check path to configuration file")
+        sys.exit(-1)
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    overrides = {key: value for key, value in (("duration", args.duration), ("time_step", args.time_step),
+                                               ("reload_interval", args.reload_interval),
+                                               ("sample_interval", args.sample_interval), ("warmup", args.warmup))
+                 if value is not None}
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    try:
+        run = SoakRun(eventloop=event_loop, config_file=args.config, config=overrides, use_broker=args.broker,
+                      streaming=args.streaming, trace=not args.no_trace)
+        report = event_loop.run_until_complete(run.run())
+    finally:
+        stop_logging()
+        event_loop.close()
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(format_report(report))
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    soak_main()
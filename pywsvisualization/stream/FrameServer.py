@@ -0,0 +1,417 @@
+"""
+HTTP Frame Streaming Server for Workspace Visualization
+
+Serves the rendered workspace frames as MJPEG streams to any number of
+browsers. Every frame is encoded once per map and the encoded bytes are
+fanned out to all viewers of that map. Single snapshots of the latest
+frame are served on request and cached per frame number.
+"""
+
+import asyncio
+import io
+import logging
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+import pygame as pg
+from .StateStream import StateChannel
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+BOUNDARY = b"wsframe"
+
+
+IMAGE_FORMATS = {"png": b"image/png", "jpeg": b"image/jpeg"}
+
+
+def encode_surface(surface, image_format="JPEG", resize=1.0, crop=None):
+    """
+    Encode a pygame surface to image bytes
+    :param surface: pygame surface (must not be drawn on while encoding)
+    :param image_format: JPEG or PNG
+    :param resize: resize factor applied before encoding
+    :param crop: (x, y, width, height) pixel rectangle applied before resizing (optional)
+    :return: encoded image bytes
+    """
+    if crop is not None:
+        surface = surface.subsurface(crop)
+    if resize != 1.0:
+        width, height = surface.get_size()
+        surface = pg.transform.smoothscale(surface, (max(1, int(width * resize)), max(1, int(height * resize))))
+    buffer = io.BytesIO()
+    pg.image.save(surface, buffer, "frame." + image_format.lower())
+    return buffer.getvalue()
+
+
+def parse_snapshot_query(query):
+    """
+    Snapshot parameters of a request query string
+    :param query: query string, e.g. "crop=0,0,400,300&scale=0.5&format=png"
+    :return: (crop rectangle or None, scale factor, image format)
+    :raises ValueError: on malformed parameters
+    """
+    params = parse_qs(query)
+    crop = None
+    if "crop" in params:
+        crop = tuple(int(value) for value in params["crop"][-1].split(","))
+        if len(crop) != 4 or crop[2] <= 0 or crop[3] <= 0:
+            raise ValueError("crop must be x,y,width,height with a positive size")
+    scale = float(params.get("scale", ["1.0"])[-1])
+    if not 0.0 < scale <= 1.0:
+        raise ValueError("scale must be in (0, 1]")
+    image_format = params.get("format", ["png"])[-1].lower()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(IMAGE_FORMATS)}")
+    return crop, scale, image_format
+
+
+class FrameChannel:
+    """
+    Encoded frame stream of one workspace with its viewers and adaptive rate control
+    """
+    def __init__(self, map_id, max_fps, min_fps, min_resize):
+        """
+        Initialization of frame channel
+        :param map_id: workspace id
+        :param max_fps: upper bound of streaming frame rate
+        :param min_fps: lower bound of streaming frame rate
+        :param min_resize: lower bound of resize factor
+        """
+        self.map_id = map_id
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.min_resize = min_resize
+        self.fps = max_fps
+        self.resize = 1.0
+        self.clients = set()
+        self.frame = None
+        self.frame_number = 0
+        self.last_submit = 0.0
+        self.encoding = False
+        self.sent = 0
+        self.dropped = 0
+        self.rendered = 0
+        self.snapshot = None
+        self.snapshot_number = 0
+        self.snapshot_waiters = []
+
+    def capture(self, surface):
+        """
+        Keep a copy of the rendered frame for snapshot requests and wake them up
+        :param surface: rendered pygame surface
+        :return: None
+        """
+        self.snapshot = surface.copy()
+        self.snapshot_number = self.rendered
+        for waiter in self.snapshot_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.snapshot_waiters = []
+
+    def fan_out(self, frame):
+        """
+        Hand an encoded frame to all viewers. Viewers that did not consume the previous
+        frame yet get it replaced by the newer one.
+        :param frame: encoded frame bytes
+        :return: None
+        """
+        self.frame = frame
+        self.frame_number += 1
+        for queue in self.clients:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            else:
+                self.sent += 1
+            queue.put_nowait(frame)
+
+    def adapt(self):
+        """
+        Adapt frame rate and resolution to the slowest viewers
+        :return: None
+        """
+        total = self.sent + self.dropped
+        if total < 2 * max(1, len(self.clients)):
+            return
+        drop_ratio = self.dropped / total
+        if drop_ratio > 0.25:
+            if self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.75)
+            else:
+                self.resize = max(self.min_resize, self.resize * 0.8)
+        elif drop_ratio < 0.05:
+            if self.resize < 1.0:
+                self.resize = min(1.0, self.resize * 1.1)
+            else:
+                self.fps = min(self.max_fps, self.fps * 1.1)
+        self.sent = 0
+        self.dropped = 0
+
+
+class FrameServer:
+    def __init__(self, eventloop, config):
+        """
+        Initialization of frame streaming server
+        :param eventloop: AsyncIO EventLoop
+        :param config: streaming configuration
+        """
+        try:
+            self.eventloop = eventloop
+            self.address = config.get("address", "0.0.0.0")
+            self.port = config.get("port", 8080)
+            self.max_fps = config.get("max_fps", 25)
+            self.min_fps = config.get("min_fps", 2)
+            self.min_resize = config.get("min_resize", 0.5)
+            self.state_fps = config.get("state_fps", 10)
+            self.keyframe_interval = config.get("keyframe_interval", 50)
+            self.max_state_backlog = max(2, config.get("max_state_backlog", 20))
+            self.snapshot_cache = max(1, config.get("snapshot_cache", 16))
+            self.snapshot_timeout = config.get("snapshot_timeout", 2.0)
+            # (map id, frame number, crop, scale, format) -> future of the encoded image, least recent first
+            self.snapshots = OrderedDict()
+            self.server = None
+            self.channels = {}
+            self.state_channels = {}
+            self.client_tasks = set()
+            assert pg.image.get_extended(), "pygame is built without JPEG support"
+        except AssertionError as e:
+            logging.critical(e)
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+            sys.exit()
+        except Exception as e:
+            logging.critical(e)
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+            sys.exit()
+
+    async def start(self):
+        """
+        Start listening for viewers
+        :return: None
+        """
+        self.server = await asyncio.start_server(self._handle_client, host=self.address, port=self.port)
+        logger.info('Frame streaming server listening on %s:%s', self.address, self.port)
+
+    async def stop(self):
+        """
+        Stop the server
+        :return: None
+        """
+        if self.server is not None:
+            self.server.close()
+            for task in list(self.client_tasks):
+                task.cancel()
+            await asyncio.gather(*self.client_tasks, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    def channel(self, map_id):
+        """
+        Frame channel of a workspace
+        :param map_id: workspace id
+        :return: FrameChannel
+        """
+        map_id = str(map_id)
+        if map_id not in self.channels:
+            self.channels[map_id] = FrameChannel(map_id=map_id, max_fps=self.max_fps, min_fps=self.min_fps,
+                                                 min_resize=self.min_resize)
+        return self.channels[map_id]
+
+    def submit(self, map_id, surface):
+        """
+        Offer a rendered frame for streaming. Called from the render loop after drawing;
+        the frame is copied only if snapshot requests are waiting, or if viewers are waiting
+        and the channel frame rate allows it. Encoding happens in the executor.
+        :param map_id: workspace id
+        :param surface: rendered pygame surface
+        :return: None
+        """
+        channel = self.channel(map_id)
+        channel.rendered += 1
+        if channel.snapshot_waiters:
+            channel.capture(surface)
+        if not channel.clients or channel.encoding:
+            return
+        now = time.monotonic()
+        if now - channel.last_submit < 1.0 / channel.fps:
+            return
+        channel.last_submit = now
+        channel.encoding = True
+        frame = surface.copy()
+        self.eventloop.create_task(self._encode(channel, frame))
+
+    def submit_state(self, workspace):
+        """
+        Offer the current scene state of a workspace for vector-state streaming.
+        Called from the render loop once per frame.
+        :param workspace: WS instance
+        :return: None
+        """
+        map_id = str(workspace.id)
+        channel = self.state_channels.get(map_id)
+        if channel is None:
+            channel = StateChannel(workspace=workspace, fps=self.state_fps, keyframe_interval=self.keyframe_interval,
+                                   max_backlog=self.max_state_backlog)
+            self.state_channels[map_id] = channel
+        elif channel.workspace is not workspace:
+            channel.attach(workspace)
+        channel.submit()
+
+    async def _encode(self, channel, surface):
+        try:
+            data = await self.eventloop.run_in_executor(None, encode_surface, surface, "JPEG", channel.resize)
+            channel.fan_out(b"--" + BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length: " +
+                            str(len(data)).encode() + b"\r\n\r\n" + data + b"\r\n")
+            channel.adapt()
+        except Exception as e:
+            logger.error('Frame encoding failed for map %s: %s', channel.map_id, e)
+        finally:
+            channel.encoding = False
+
+    async def _handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.client_tasks.add(task)
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode(errors="replace").split()
+            url = urlsplit(parts[1] if len(parts) > 1 else "/")
+            path = url.path
+            if path.startswith("/snapshot/"):
+                await self._snapshot(path[len("/snapshot/"):], url.query, writer)
+            elif path.startswith("/stream/"):
+                await self._stream(path[len("/stream/"):], writer)
+            elif path.startswith("/state/"):
+                await self._state(path[len("/state/"):], writer)
+            elif path == "/":
+                await self._index(writer)
+            else:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error('Frame streaming client failed: %s', e)
+        finally:
+            self.client_tasks.discard(task)
+            writer.close()
+
+    async def _index(self, writer):
+        body = "".join(f'<h3>map {map_id} (<a href="/snapshot/{map_id}">snapshot</a>)</h3><img src="/stream/{map_id}">'
+                       for map_id in self.channels)
+        body = f"<html><head><title>Workspace</title></head><body>{body}</body></html>".encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: " + str(len(body)).encode() +
+                     b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+
+    async def _stream(self, map_id, writer):
+        if map_id not in self.channels:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        channel = self.channels[map_id]
+        # a single slot per viewer: slow viewers skip frames instead of buffering them
+        queue = asyncio.Queue(maxsize=1)
+        if channel.frame is not None:
+            queue.put_nowait(channel.frame)
+        channel.clients.add(queue)
+        logger.info('Viewer joined map %s (%d viewers)', map_id, len(channel.clients))
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\nConnection: close\r\n"
+                         b"Content-Type: multipart/x-mixed-replace; boundary=" + BOUNDARY + b"\r\n\r\n")
+            while True:
+                frame = await queue.get()
+                writer.write(frame)
+                await writer.drain()
+        finally:
+            channel.clients.discard(queue)
+            logger.info('Viewer left map %s (%d viewers)', map_id, len(channel.clients))
+
+    async def _state(self, map_id, writer):
+        if map_id not in self.state_channels:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        channel = self.state_channels[map_id]
+        client = channel.join()
+        logger.info('State subscriber joined map %s (%d subscribers)', map_id, len(channel.clients))
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\nConnection: close\r\n"
+                         b"Content-Type: application/x-ndjson\r\n\r\n")
+            while True:
+                writer.write(await client.queue.get())
+                await writer.drain()
+        finally:
+            channel.leave(client)
+            logger.info('State subscriber left map %s (%d subscribers)', map_id, len(channel.clients))
+
+    async def _snapshot(self, map_id, query, writer):
+        if map_id not in self.channels:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        channel = self.channels[map_id]
+        try:
+            crop, scale, image_format = parse_snapshot_query(query)
+        except ValueError as e:
+            await self._bad_request(writer, str(e))
+            return
+        # a frame rendered after the last capture is captured by the render loop on its next submit
+        if channel.snapshot is None or channel.snapshot_number != channel.rendered:
+            waiter = self.eventloop.create_future()
+            channel.snapshot_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.snapshot_timeout)
+            except asyncio.TimeoutError:
+                # render loop stalled: serve the last captured frame if there is one
+                pass
+            finally:
+                if waiter in channel.snapshot_waiters:
+                    channel.snapshot_waiters.remove(waiter)
+        surface = channel.snapshot
+        if surface is None:
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        if crop is not None:
+            crop = tuple(pg.Rect(crop).clip(surface.get_rect()))
+            if crop[2] == 0 or crop[3] == 0:
+                await self._bad_request(writer, "crop is outside of the frame")
+                return
+        frame_number = channel.snapshot_number
+        data = await self._encode_snapshot(channel, surface, frame_number, crop, scale, image_format)
+        writer.write(b"HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\nConnection: close\r\nContent-Type: " +
+                     IMAGE_FORMATS[image_format] + b"\r\nX-Frame-Number: " + str(frame_number).encode() +
+                     b"\r\nContent-Length: " + str(len(data)).encode() + b"\r\n\r\n" + data)
+        await writer.drain()
+
+    async def _encode_snapshot(self, channel, surface, frame_number, crop, scale, image_format):
+        # concurrent requests for the same frame and parameters share one encoding
+        key = (channel.map_id, frame_number, crop, scale, image_format)
+        encoded = self.snapshots.get(key)
+        if encoded is None:
+            encoded = self.eventloop.run_in_executor(None, encode_surface, surface, image_format.upper(), scale, crop)
+            self.snapshots[key] = encoded
+            while len(self.snapshots) > self.snapshot_cache:
+                self.snapshots.popitem(last=False)
+        else:
+            self.snapshots.move_to_end(key)
+        try:
+            # shielded: a client hanging up must not cancel the encoding for the others
+            return await asyncio.shield(encoded)
+        except Exception as e:
+            if self.snapshots.get(key) is encoded:
+                del self.snapshots[key]
+            logger.error('Snapshot encoding failed for map %s: %s', channel.map_id, e)
+            raise
+
+    async def _bad_request(self, writer, reason):
+        body = reason.encode()
+        writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain\r\nContent-Length: " +
+                     str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
@@ -0,0 +1,190 @@
+"""
+Vector-State Streaming for Workspace Visualization
+
+Streams the scene state as newline-delimited JSON instead of pixels:
+    - layout: static layout of the map, sent once on join
+    - key: full robot/particle state (on join, periodically and after overflow)
+    - delta: robot/particle entries that changed since the previous state frame
+Entities are keyed by id; a `null` entry removes an evicted entity.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+
+def encode_state(message):
+    """
+    Encode a state message as one compact JSON line
+    :param message: state message dictionary
+    :return: encoded bytes
+    """
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class StateClient:
+    """
+    Subscriber of a state channel. Deltas cannot be skipped, so a subscriber that
+    falls behind has its backlog discarded and is resynchronised with a keyframe.
+    """
+    def __init__(self, max_backlog):
+        """
+        Initialization of state subscriber
+        :param max_backlog: number of pending state frames before resynchronisation
+        """
+        self.queue = asyncio.Queue(maxsize=max_backlog)
+        self.needs_keyframe = False
+        self.resyncs = 0
+
+    def offer(self, delta, keyframe):
+        """
+        Queue the next state frame
+        :param delta: encoded delta frame
+        :param keyframe: callable returning the encoded keyframe of the current state
+        :return: None
+        """
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.needs_keyframe = True
+            self.resyncs += 1
+        if self.needs_keyframe:
+            self.queue.put_nowait(keyframe())
+            self.needs_keyframe = False
+        else:
+            self.queue.put_nowait(delta)
+
+
+class StateChannel:
+    """
+    Vector-state stream of one workspace
+    """
+    def __init__(self, workspace, fps, keyframe_interval, max_backlog):
+        """
+        Initialization of state channel
+        :param workspace: WS instance
+        :param fps: state frames per second
+        :param keyframe_interval: number of state frames between keyframes
+        :param max_backlog: number of pending state frames per subscriber before resynchronisation
+        """
+        self.workspace = workspace
+        self.fps = fps
+        self.keyframe_interval = keyframe_interval
+        self.max_backlog = max_backlog
+        self.clients = set()
+        self.frame_number = 0
+        self.last_submit = 0.0
+        self.robot_versions = {}
+        self.particle_versions = {}
+        self._layout = None
+        self._keyframe = None
+
+    def layout(self):
+        """
+        Encoded static layout (built once)
+        :return: encoded layout message
+        """
+        if self._layout is None:
+            message = self.workspace.get_layout_state()
+            message["type"] = "layout"
+            self._layout = encode_state(message)
+        return self._layout
+
+    def keyframe(self):
+        """
+        Encoded full state of all reported entities (built at most once per state frame)
+        :return: encoded keyframe message
+        """
+        if self._keyframe is None:
+            robots = {}
+            for robot in self.workspace.robots.robots:
+                state = robot.as_state()
+                if state is not None and robot.last_seen is not None:
+                    robots[robot.id] = state
+            particles = {}
+            for particle in self.workspace.particles.particles:
+                state = particle.as_state()
+                if state is not None:
+                    particles[particle.id] = state
+            self._keyframe = encode_state({"type": "key", "frame": self.frame_number,
+                                           "robots": robots, "particles": particles})
+        return self._keyframe
+
+    def _delta(self):
+        robots = {}
+        for robot in self.workspace.robots.robots:
+            if self.robot_versions.get(robot.id, 0) != robot.version:
+                self.robot_versions[robot.id] = robot.version
+                robots[robot.id] = robot.as_state()
+        particles = {}
+        for particle in self.workspace.particles.particles:
+            if self.particle_versions.get(particle.id, 0) != particle.version:
+                self.particle_versions[particle.id] = particle.version
+                particles[particle.id] = particle.as_state()
+        return encode_state({"type": "delta", "frame": self.frame_number, "robots": robots, "particles": particles})
+
+    def submit(self):
+        """
+        Produce the next state frame and hand it to all subscribers
+        :return: None
+        """
+        if not self.clients:
+            return
+        now = time.monotonic()
+        if now - self.last_submit < 1.0 / self.fps:
+            return
+        self.last_submit = now
+        self.frame_number += 1
+        self._keyframe = None
+        delta = self._delta()
+        if self.frame_number % self.keyframe_interval == 0:
+            for client in self.clients:
+                client.needs_keyframe = True
+        for client in self.clients:
+            client.offer(delta=delta, keyframe=self.keyframe)
+
+    def attach(self, workspace):
+        """
+        Attach a (re)created workspace, e.g. after configuration reload. Subscribers are
+        resynchronised with the new layout and a keyframe.
+        :param workspace: WS instance
+        :return: None
+        """
+        self.workspace = workspace
+        self.robot_versions = {}
+        self.particle_versions = {}
+        self._layout = None
+        self._keyframe = None
+        for client in self.clients:
+            self._resync(client)
+
+    def _resync(self, client):
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        client.queue.put_nowait(self.layout())
+        client.queue.put_nowait(self.keyframe())
+        client.needs_keyframe = False
+
+    def join(self):
+        """
+        Subscribe to the channel. The subscriber starts with layout and a snapshot of the current state.
+        :return: StateClient
+        """
+        client = StateClient(max_backlog=self.max_backlog)
+        # entities may have changed since the last state frame
+        self._keyframe = None
+        self._resync(client)
+        self.clients.add(client)
+        return client
+
+    def leave(self, client):
+        """
+        Unsubscribe from the channel
+        :param client: StateClient
+        :return: None
+        """
+        self.clients.discard(client)
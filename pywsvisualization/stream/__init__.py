@@ -0,0 +1,30 @@
+from __future__ import generator_stop
+from __future__ import annotations
+import importlib
+
+# exported names and their modules, imported on first access
+_exports = {
+    'FrameServer': '.FrameServer',
+    'encode_surface': '.FrameServer',
+    'StateChannel': '.StateStream',
+    'encode_state': '.StateStream'
+}
+
+__all__ = [
+    'FrameServer',
+    'encode_surface',
+    'StateChannel',
+    'encode_state'
+]
+
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
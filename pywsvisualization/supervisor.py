@@ -0,0 +1,433 @@
+"""
+Supervisor for Workspace Visualization
+
+Runs groups of maps in separate worker processes. Every worker subscribes and
+renders its maps off-screen and copies each frame into a shared memory block
+per map; metrics and, with streaming enabled, the entity state of the maps are
+reported through a queue. The supervisor composites the frames into one window
+(and the streaming server, if enabled, including vector-state streaming), logs
+the metrics and restarts workers that die.
+"""
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import struct
+import sys
+import time
+import traceback
+import weakref
+from multiprocessing import shared_memory
+import pygame as pg
+
+# logger for this file
+logger = logging.getLogger(__name__)
+
+# shared frame header: sequence number (odd while the frame is written), width, height
+FRAME_HEADER = struct.Struct("<QII")
+
+
+class SharedFrame:
+    """
+    RGB frame of one map in shared memory, written by a worker and read by the supervisor
+    """
+    def __init__(self, name, size=None, create=False):
+        """
+        Initialization of shared frame
+        :param name: shared memory block name
+        :param size: frame size (width, height) in pixels, required when creating
+        :param create: create the shared memory block
+        """
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=FRAME_HEADER.size + size[0] * size[1] * 3)
+            FRAME_HEADER.pack_into(self.shm.buf, 0, 0, size[0], size[1])
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.sequence, width, height = FRAME_HEADER.unpack_from(self.shm.buf, 0)
+        self.size = (width, height)
+
+    def write(self, surface):
+        """
+        Copy a rendered surface into shared memory
+        :param surface: pygame surface of the frame size
+        :return: None
+        """
+        if surface.get_size() != self.size:
+            logger.error('Frame size %s does not match shared frame size %s', surface.get_size(), self.size)
+            return
+        pixels = pg.image.tostring(surface, "RGB")
+        FRAME_HEADER.pack_into(self.shm.buf, 0, self.sequence + 1, self.size[0], self.size[1])
+        self.shm.buf[FRAME_HEADER.size:FRAME_HEADER.size + len(pixels)] = pixels
+        self.sequence += 2
+        FRAME_HEADER.pack_into(self.shm.buf, 0, self.sequence, self.size[0], self.size[1])
+
+    def read(self):
+        """
+        Read the latest complete frame
+        :return: frame sequence number and pygame surface, or None if no complete frame is available
+        """
+        sequence = FRAME_HEADER.unpack_from(self.shm.buf, 0)[0]
+        if sequence == 0 or sequence % 2:
+            return None
+        pixels = bytes(self.shm.buf[FRAME_HEADER.size:FRAME_HEADER.size + self.size[0] * self.size[1] * 3])
+        if FRAME_HEADER.unpack_from(self.shm.buf, 0)[0] != sequence:
+            # torn read, the worker wrote a new frame meanwhile
+            return None
+        return sequence, pg.image.frombuffer(pixels, self.size, "RGB")
+
+    def close(self, unlink=False):
+        """
+        Release the shared memory block
+        :param unlink: remove the block (owner only)
+        :return: None
+        """
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def state_report(workspace, layout=False):
+    """
+    Entity state of a workspace for vector-state streaming through the supervisor
+    :param workspace: WS instance
+    :param layout: include the static layout
+    :return: report dictionary
+    """
+    report = {"type": "state", "id": workspace.id,
+              "robots": [(robot.id, robot.version, robot.last_seen is not None, robot.as_state())
+                         for robot in workspace.robots.robots],
+              "particles": [(particle.id, particle.version, particle.last_seen is not None, particle.as_state())
+                            for particle in workspace.particles.particles]}
+    if layout:
+        report["layout"] = workspace.get_layout_state()
+    return report
+
+
+class RemoteEntity:
+    """
+    Robot or particle state reported by a worker, with the interface used by StateChannel
+    """
+    __slots__ = ("id", "version", "last_seen", "state")
+
+    def __init__(self, id, version, seen, state):
+        self.id = id
+        self.version = version
+        self.last_seen = 0.0 if seen else None
+        self.state = state
+
+    def as_state(self):
+        return self.state
+
+
+class RemoteEntities:
+    """
+    Robot and particle lists of a remote workspace
+    """
+    def __init__(self):
+        self.robots = []
+        self.particles = []
+
+
+class RemoteWorkspace:
+    """
+    Stand-in for the WS of a worker process, fed from its state reports. A new instance is
+    created whenever the worker sends a layout (start, restart, reload), so that state
+    channels resynchronise their subscribers.
+    """
+    def __init__(self, map_id, layout):
+        """
+        Initialization of remote workspace
+        :param map_id: workspace id
+        :param layout: static layout as returned by WS.get_layout_state
+        """
+        self.id = map_id
+        self.layout = layout
+        self.robots = RemoteEntities()
+        self.particles = RemoteEntities()
+
+    def get_layout_state(self):
+        return self.layout
+
+    def update(self, report):
+        """
+        Apply a state report of the worker
+        :param report: report dictionary (see state_report)
+        :return: None
+        """
+        self.robots.robots = [RemoteEntity(*robot) for robot in report["robots"]]
+        self.particles.particles = [RemoteEntity(*particle) for particle in report["particles"]]
+
+
+def worker_main(config_file, map_ids, frame_names, report_queue, metrics_interval, state_interval=None):
+    """
+    Worker process: run the given maps headless and publish frames, metrics and entity state
+    :param config_file: configuration file path
+    :param map_ids: ids of the maps of this worker
+    :param frame_names: shared memory block name per map id
+    :param report_queue: multiprocessing queue for metrics and state reports
+    :param metrics_interval: seconds between metric reports
+    :param state_interval: seconds between state reports (None: no state reports)
+    :return: None
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    # keep SIGTERM from the supervisor fatal instead of turning it into a pygame QUIT event
+    os.environ["SDL_NO_SIGNAL_HANDLERS"] = "1"
+    from pywsvisualization.cli import app
+    from pywsvisualization.log import stop_logging
+    frames = {map_id: SharedFrame(name=name) for map_id, name in frame_names.items()}
+    last_report = {}
+    last_state = {}
+    # workspace whose layout was reported last, per map (a reload creates new workspaces)
+    layouts = {}
+
+    def publish(workspace):
+        frames[workspace.id].write(workspace.screen)
+        now = time.monotonic()
+        if now - last_report.get(workspace.id, 0.0) >= metrics_interval:
+            last_report[workspace.id] = now
+            try:
+                report_queue.put_nowait(dict(workspace.get_metrics(), type="metrics"))
+            except queue.Full:
+                pass
+        if state_interval is not None and now - last_state.get(workspace.id, 0.0) >= state_interval:
+            last_state[workspace.id] = now
+            reported = layouts.get(workspace.id)
+            layout = reported is None or reported() is not workspace
+            try:
+                report_queue.put_nowait(state_report(workspace, layout=layout))
+                if layout:
+                    layouts[workspace.id] = weakref.ref(workspace)
+            except queue.Full:
+                pass
+
+    try:
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+        event_loop.run_until_complete(app(event_loop, config_file, map_ids=map_ids, headless=True,
+                                          frame_callback=publish, streaming=False))
+    finally:
+        # flush the records of a failing worker before the process ends
+        stop_logging()
+
+
+class Worker:
+    """
+    Worker process handle with restart backoff
+    """
+    def __init__(self, map_ids):
+        """
+        Initialization of worker handle
+        :param map_ids: ids of the maps of this worker
+        """
+        self.map_ids = map_ids
+        self.process = None
+        self.restarts = 0
+        self.backoff = 0.0
+        self.next_start = 0.0
+        self.started = 0.0
+
+
+class Supervisor:
+    def __init__(self, eventloop, config_file, scene_config):
+        """
+        Initialization of supervisor
+        :param eventloop: AsyncIO EventLoop
+        :param config_file: configuration file path (passed on to the workers)
+        :param scene_config: scene configuration
+        """
+        try:
+            config = scene_config.get("supervisor", {})
+            self.eventloop = eventloop
+            self.config_file = config_file
+            self.interval = scene_config["attributes"]["interval"]
+            self.maps_per_worker = config.get("maps_per_worker", 1)
+            self.restart_backoff = config.get("restart_backoff", 1.0)
+            self.max_restart_backoff = config.get("max_restart_backoff", 30.0)
+            # a worker that ran this long is considered healthy again
+            self.stable_time = config.get("stable_time", 60.0)
+            self.metrics_interval = config.get("metrics_interval", 1.0)
+            streaming_config = scene_config.get("streaming") or {}
+            # workers report entity state for vector-state streaming only if streaming is enabled
+            self.state_interval = 1.0 / streaming_config.get("state_fps", 10) \
+                if streaming_config.get("enable", False) else None
+            self.composite_scale = config.get("composite_scale", 1.0)
+            self.headless = config.get("headless", False)
+            self.context = multiprocessing.get_context("spawn")
+            self.report_queue = self.context.Queue(maxsize=1000)
+            self.metrics = {}
+            self.last_metrics_log = 0.0
+            self.remote = {}
+            self.frames = {}
+            self.sequences = {}
+            self.surfaces = {}
+            scaling = scene_config["attributes"]["scaling"]
+            map_ids = []
+            for mape in scene_config["maps"]:
+                map_ids.append(mape["id"])
+                size = (int(mape["render"]["dimensions"][0] * scaling), int(mape["render"]["dimensions"][1] * scaling))
+                name = f"wsframe_{os.getpid()}_{mape['id']}"
+                self.frames[mape["id"]] = SharedFrame(name=name, size=size, create=True)
+            self.workers = [Worker(map_ids=map_ids[i:i + self.maps_per_worker])
+                            for i in range(0, len(map_ids), self.maps_per_worker)]
+            self.screen = None
+            self.tiles = {}
+        except AssertionError as e:
+            logging.critical(e)
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+            sys.exit()
+        except Exception as e:
+            logging.critical(e)
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            logging.critical(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+            sys.exit()
+
+    def _layout_tiles(self):
+        """
+        Arrange the maps in a grid on the composite screen
+        :return: composite screen size
+        """
+        columns = math.ceil(math.sqrt(len(self.frames)))
+        x = y = row_height = width = 0
+        for index, (map_id, frame) in enumerate(self.frames.items()):
+            if index and index % columns == 0:
+                x = 0
+                y += row_height
+                row_height = 0
+            size = (int(frame.size[0] * self.composite_scale), int(frame.size[1] * self.composite_scale))
+            self.tiles[map_id] = (x, y, size)
+            x += size[0]
+            width = max(width, x)
+            row_height = max(row_height, size[1])
+        return width, y + row_height
+
+    def _start(self, worker):
+        names = {map_id: self.frames[map_id].shm.name for map_id in worker.map_ids}
+        worker.process = self.context.Process(target=worker_main,
+                                              args=(self.config_file, worker.map_ids, names, self.report_queue,
+                                                    self.metrics_interval, self.state_interval),
+                                              name=f"ws-worker-{'-'.join(worker.map_ids)}",
+                                              daemon=True)
+        worker.process.start()
+        worker.started = time.monotonic()
+        logger.info('Started worker %d for maps %s', worker.process.pid, worker.map_ids)
+
+    def _supervise(self):
+        """
+        Restart dead workers with exponential backoff
+        :return: None
+        """
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                if worker.backoff and now - worker.started > self.stable_time:
+                    worker.backoff = 0.0
+                continue
+            if worker.process is not None:
+                logger.error('Worker for maps %s exited with code %s', worker.map_ids, worker.process.exitcode)
+                worker.process = None
+                worker.restarts += 1
+                worker.backoff = min(self.max_restart_backoff, max(self.restart_backoff, worker.backoff * 2))
+                worker.next_start = now + worker.backoff
+            if now >= worker.next_start:
+                self._start(worker)
+
+    def _collect_reports(self):
+        while True:
+            try:
+                report = self.report_queue.get_nowait()
+            except queue.Empty:
+                break
+            if report.pop("type", "metrics") == "state":
+                map_id = report["id"]
+                if "layout" in report:
+                    self.remote[map_id] = RemoteWorkspace(map_id=map_id, layout=report["layout"])
+                if map_id in self.remote:
+                    self.remote[map_id].update(report)
+            else:
+                self.metrics[report["id"]] = report
+        now = time.monotonic()
+        if self.metrics and now - self.last_metrics_log >= self.metrics_interval:
+            self.last_metrics_log = now
+            logger.info('Supervisor metrics: %s', self.get_metrics())
+
+    def get_metrics(self):
+        """
+        Latest metrics of all maps and worker restart counts
+        :return: dictionary
+        """
+        return {
+            "maps": dict(self.metrics),
+            "restarts": {"-".join(worker.map_ids): worker.restarts for worker in self.workers}
+        }
+
+    def composite(self, frame_server=None):
+        """
+        Read new frames from shared memory, blit them onto the composite screen and offer
+        them to the streaming server
+        :param frame_server: FrameServer (optional)
+        :return: None
+        """
+        for map_id, frame in self.frames.items():
+            result = frame.read()
+            if result is None or result[0] == self.sequences.get(map_id):
+                continue
+            self.sequences[map_id] = result[0]
+            self.surfaces[map_id] = result[1]
+            if frame_server is not None:
+                frame_server.submit(map_id=map_id, surface=result[1])
+                if map_id in self.remote:
+                    frame_server.submit_state(workspace=self.remote[map_id])
+            if self.screen is not None:
+                x, y, size = self.tiles[map_id]
+                surface = result[1] if size == frame.size else pg.transform.smoothscale(result[1], size)
+                self.screen.blit(surface, (x, y))
+
+    async def run(self, frame_server=None, stop=None):
+        """
+        Supervise the workers until stopped
+        :param frame_server: FrameServer (optional)
+        :param stop: callable returning True when the supervisor should stop (optional)
+        :return: None
+        """
+        size = self._layout_tiles()
+        if not self.headless:
+            pg.init()
+            self.screen = pg.display.set_mode(size)
+        try:
+            while stop is None or not stop():
+                if self.screen is not None:
+                    for event in pg.event.get():
+                        if event.type == pg.QUIT:
+                            return
+                self._supervise()
+                self._collect_reports()
+                self.composite(frame_server=frame_server)
+                if self.screen is not None:
+                    pg.display.update()
+                await asyncio.sleep(self.interval)
+        finally:
+            self.terminate()
+
+    def terminate(self):
+        """
+        Stop all workers and release shared memory
+        :return: None
+        """
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+                worker.process = None
+        for frame in self.frames.values():
+            frame.close(unlink=True)
+        self.frames = {}